@@ -0,0 +1,333 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+import contextlib
+import numpy as np
+from PIL import Image
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+BENCH_DIR = './out/bench/'
+
+# Pages per run for each preset; floor runs use a tenth of that per grid size
+SCALES = {'small': 10, 'medium': 100, 'large': 1000}
+# Smaller floors fail the perspective crop and would only time the flat fallback
+FLOOR_GRIDS = (16, 20, 40, 60)
+CASES = ('simple_catalog', 'make_catalog', 'floor', 'wall')
+
+# Synthetic corpus: a pool of distinct tiles reused across pages, like real catalogs
+CORPUS_VERSION = 2
+TILE_POOL = 40
+WALL_TILE_SIZE = (600, 400)
+FLOOR_TILE_SIZE = (600, 600)
+CATALOG_IMAGE_SIZE = (1000, 1000)
+
+# Stages shorter than this are too noisy to flag as regressions
+NOISE_FLOOR = 0.05
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark the catalog tools on a synthetic tile corpus')
+    parser.add_argument('--scale', choices=SCALES, default='small',
+                        help='Corpus size: small (10 pages), medium (100) or large (1000) (default: small)')
+    parser.add_argument('--cases', default=','.join(CASES),
+                        help=f'Comma separated tools to run (default: {",".join(CASES)})')
+    parser.add_argument('--floor-engine', choices=('grid', 'direct'), default='grid',
+                        help='Floor engine used by the floor cases (default: grid)')
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='Run every case N times and keep the fastest (default: 1)')
+    parser.add_argument('--out', default=None,
+                        help='Results JSON path (default: out/bench/results-{scale}-{timestamp}.json)')
+    parser.add_argument('--baseline', default=None,
+                        help='Earlier results JSON to compare against; exits with status 1 on a regression')
+    parser.add_argument('--tolerance', type=float, default=0.15,
+                        help='Allowed slowdown against the baseline as a fraction (default: 0.15)')
+    parser.add_argument('--run-case', help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+def synthetic_tile(rng: np.random.Generator, size: tuple) -> Image.Image:
+    """A smooth random texture with fine grain, so it compresses like a photographed tile"""
+    w, h = size
+    base = Image.fromarray(rng.integers(0, 256, (6, 6, 3), dtype=np.uint8)).resize(size, Image.BICUBIC)
+    grain = rng.normal(0, 12, (h, w, 3))
+    return Image.fromarray(np.clip(np.asarray(base, dtype=np.float32) + grain, 0, 255).astype(np.uint8))
+
+def build_corpus(corpus_dir: str, pages: int) -> dict:
+    """Create (or reuse) the synthetic images and JSON configs for one scale
+    Returns:
+        Paths of the generated inputs for every case
+    """
+    marker = os.path.join(corpus_dir, 'corpus.json')
+    try:
+        with open(marker) as f:
+            corpus = json.load(f)
+        if corpus.get('version') == CORPUS_VERSION:
+            return corpus
+    except (FileNotFoundError, json.JSONDecodeError):
+        pass
+
+    print(f"Generating synthetic corpus for {pages} pages in {corpus_dir}")
+    shutil.rmtree(corpus_dir, ignore_errors=True)
+    rng = np.random.default_rng(0)
+    dirs = {name: os.path.abspath(os.path.join(corpus_dir, name)) for name in ('wall', 'floor', 'catalog')}
+    for path in dirs.values():
+        os.makedirs(path)
+
+    wall_tiles = [f'W{i:03d}.jpg' for i in range(TILE_POOL)]
+    for name in wall_tiles:
+        synthetic_tile(rng, WALL_TILE_SIZE).save(os.path.join(dirs['wall'], name), quality=90)
+    floor_tiles = [os.path.join(dirs['floor'], f'F{i:03d}.jpg') for i in range(TILE_POOL)]
+    for path in floor_tiles:
+        synthetic_tile(rng, FLOOR_TILE_SIZE).save(path, quality=90)
+    # simple_catalog lays out a whole directory, so it gets one distinct image per page
+    catalog_images = [f'C{i:04d}.jpg' for i in range(pages)]
+    for name in catalog_images:
+        synthetic_tile(rng, CATALOG_IMAGE_SIZE).save(os.path.join(dirs['catalog'], name), quality=90)
+
+    wall_pages = []
+    for i in range(pages):
+        tiles = [wall_tiles[(i + k) % TILE_POOL] for k in range(4)]
+        page = {'title': f'W{i:04d}', 'path': dirs['wall'], 'images': tiles, 'footer': tiles[:3]}
+        if i % 3 == 0:
+            page['images_random'] = [wall_tiles[(i + k) % TILE_POOL] for k in range(4, 8)]
+        wall_pages.append(page)
+    wall_config = {'title': 'Benchmark wall catalog', 'pages': wall_pages}
+
+    floor_pages = max(1, pages // 10)
+    floor_configs = {}
+    for grid in FLOOR_GRIDS:
+        floor_configs[str(grid)] = {
+            'output_pdf': './out/floor.pdf',
+            'title': 'Benchmark floor catalog',
+            'rows': grid,
+            'cols': grid,
+            'pages': [{'title': f'F{i:04d}', 'file': floor_tiles[i % TILE_POOL],
+                       'rotate': i % 2 == 0, 'padding': 2} for i in range(floor_pages)]
+        }
+
+    make_catalog_config = {
+        'image_path': dirs['catalog'],
+        'output_pdf': './out/make_catalog.pdf',
+        'title': 'Benchmark catalog',
+        'pages': [[catalog_images[(i * 9 + k) % len(catalog_images)] for k in range(9)] for i in range(pages)]
+    }
+
+    corpus = {'version': CORPUS_VERSION, 'pages': pages, 'catalog_dir': dirs['catalog'], 'configs': {}}
+    for name, config in [('wall', wall_config), ('make_catalog', make_catalog_config)] + \
+                        [(f'floor-{grid}', config) for grid, config in floor_configs.items()]:
+        path = os.path.abspath(os.path.join(corpus_dir, f'{name}.json'))
+        with open(path, 'w') as f:
+            json.dump(config, f, indent=1)
+        corpus['configs'][name] = path
+    with open(marker, 'w') as f:
+        json.dump(corpus, f, indent=1)
+    return corpus
+
+def peak_rss_mb() -> float | None:
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return rss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+class StageTimer:
+    """Collects wall and CPU time per top-level section of a case (render, pdf, ...)"""
+
+    def __init__(self):
+        self.stages = {}
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            self.stages[name] = {'wall': time.perf_counter() - wall_start,
+                                 'cpu': time.process_time() - cpu_start}
+
+def profile_stages(events: list) -> dict:
+    """Wall and CPU seconds per profiler stage (decode, compose, warp, encode, ...), summed over calls
+    Stages nest, so they can add up to more than the case's total.
+    """
+    stages = {}
+    for name, _, wall, cpu, _, _, _, _ in events:
+        if name == 'page':
+            continue  # Per-page wrapper around the stages
+        stage = stages.setdefault(name, {'wall': 0.0, 'cpu': 0.0})
+        stage['wall'] += wall / 1e9
+        stage['cpu'] += cpu / 1e9
+    return stages
+
+def run_case(case: str, corpus: dict, floor_engine: str = 'grid') -> dict:
+    """Run one case in the current process (cwd is a scratch dir) and time its stages"""
+    sys.path.insert(0, REPO_DIR)
+    from profiler import profiler
+    profiler.enable()
+    timer = StageTimer()
+    configs = corpus['configs']
+
+    with contextlib.redirect_stdout(open(os.devnull, 'w')):
+        if case == 'simple_catalog':
+            import simple_catalog
+            with timer.stage('catalog'):
+                simple_catalog.generate_catalog(corpus['catalog_dir'], './out/simple_catalog.pdf')
+        elif case == 'make_catalog':
+            import make_catalog
+            from reportlab.lib.pagesizes import A4
+            with timer.stage('load'):
+                config = make_catalog.load_config(configs['make_catalog'])
+            with timer.stage('catalog'):
+                make_catalog.generate_catalog(config, make_catalog.LayoutConfig(page_width=A4[0], page_height=A4[1]))
+        elif case.startswith('floor-'):
+            import visualize_floor
+            with open(configs[case]) as f:
+                config = json.load(f)
+            with timer.stage('render'):
+                files = visualize_floor.json_process(configs[case], force=True, engine=floor_engine)
+            with timer.stage('pdf'):
+                visualize_floor.make_pdf(files, config['output_pdf'], config['title'])
+        elif case == 'wall':
+            import visualize_wall
+            with open(configs['wall']) as f:
+                config = json.load(f)
+            with timer.stage('render'):
+                images = visualize_wall.create_wall_visualization(config, force=True)
+            with timer.stage('pdf'):
+                visualize_wall.generate_pdf(images, './out/wall.pdf', title=config['title'])
+        else:
+            raise ValueError(f"Unknown case: {case}")
+
+    return {
+        'total': sum(section['wall'] for section in timer.stages.values()),
+        'sections': timer.stages,
+        'stages': profile_stages(profiler.take_events()),
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+def run_case_subprocess(case: str, corpus_path: str, floor_engine: str = 'grid') -> dict:
+    """Run a case in a fresh interpreter and scratch directory so caches start cold"""
+    work_dir = tempfile.mkdtemp(prefix=f'{case}-', dir=os.path.abspath(os.path.join(BENCH_DIR, 'work')))
+    try:
+        result = subprocess.run([sys.executable, os.path.abspath(__file__), '--run-case', f'{case}:{corpus_path}',
+                                 '--floor-engine', floor_engine],
+                                cwd=work_dir, capture_output=True, text=True)
+        if result.returncode in (-9, 137):
+            raise RuntimeError('killed (out of memory?)')
+        if result.returncode != 0:
+            stderr = result.stderr.strip()
+            raise RuntimeError(stderr.splitlines()[-1] if stderr else f'exit status {result.returncode}')
+        return json.loads(result.stdout.strip().splitlines()[-1])
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def case_names(selected: list) -> list:
+    names = []
+    for case in selected:
+        if case == 'floor':
+            names += [f'floor-{grid}' for grid in FLOOR_GRIDS]
+        else:
+            names.append(case)
+    return names
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """Print current vs baseline timings and return the stages that regressed"""
+    regressions = []
+    print(f"\n{'case':<16}{'stage':<14}{'baseline':>10}{'current':>10}{'change':>9}")
+    for case, current in results['cases'].items():
+        before = baseline.get('cases', {}).get(case)
+        if not before or 'stages' not in current or 'stages' not in before:
+            continue
+        rows = [(name, before['stages'][name]['wall'], stage['wall'])
+                for name, stage in current['stages'].items() if name in before['stages']]
+        rows.append(('total', before['total'], current['total']))
+        for name, old, new in rows:
+            change = (new - old) / old if old else 0.0
+            flag = ''
+            if change > tolerance and new - old > NOISE_FLOOR:
+                regressions.append(f'{case}/{name}')
+                flag = '  REGRESSION'
+            print(f"{case:<16}{name:<14}{old:>9.2f}s{new:>9.2f}s{change:>+8.0%}{flag}")
+    return regressions
+
+def main():
+    args = parse_args()
+
+    if args.run_case:
+        case, corpus_path = args.run_case.split(':', 1)
+        with open(corpus_path) as f:
+            corpus = json.load(f)
+        print(json.dumps(run_case(case, corpus, args.floor_engine)))
+        return
+
+    pages = SCALES[args.scale]
+    corpus_dir = os.path.join(BENCH_DIR, f'corpus-{args.scale}')
+    corpus = build_corpus(corpus_dir, pages)
+    corpus_path = os.path.abspath(os.path.join(corpus_dir, 'corpus.json'))
+    os.makedirs(os.path.join(BENCH_DIR, 'work'), exist_ok=True)
+
+    results = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'scale': args.scale,
+        'pages': pages,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'floor_engine': args.floor_engine,
+        'cases': {},
+    }
+
+    print(f"{'case':<16}{'total':>9}  {'peak RSS':>10}  stages (inclusive of nested stages)")
+    for case in case_names([c.strip() for c in args.cases.split(',') if c.strip()]):
+        runs = []
+        try:
+            for _ in range(max(1, args.repeat)):
+                runs.append(run_case_subprocess(case, corpus_path, args.floor_engine))
+        except Exception as e:
+            print(f"{case:<16}failed: {e}")
+            results['cases'][case] = {'error': str(e)}
+            continue
+        # Keep the fastest run of every section and stage; peak memory is the worst seen
+        best = min(runs, key=lambda r: r['total'])
+        for key in ('sections', 'stages'):
+            for name in best[key]:
+                best[key][name] = min((r[key][name] for r in runs if name in r[key]), key=lambda s: s['wall'])
+        best['total'] = sum(section['wall'] for section in best['sections'].values())
+        rss = [r['peak_rss_mb'] for r in runs if r['peak_rss_mb'] is not None]
+        best['peak_rss_mb'] = max(rss) if rss else None
+        results['cases'][case] = best
+
+        stages = ', '.join(f"{name} {stage['wall']:.2f}s" for name, stage in
+                           sorted(best['stages'].items(), key=lambda item: -item[1]['wall']))
+        rss_text = f"{best['peak_rss_mb']:.0f} MB" if best['peak_rss_mb'] is not None else 'n/a'
+        print(f"{case:<16}{best['total']:>8.2f}s  {rss_text:>10}  {stages}")
+
+    out_path = args.out or os.path.join(BENCH_DIR, f"results-{args.scale}-{time.strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(out_path) or '.', exist_ok=True)
+    with open(out_path, 'w') as f:
+        json.dump(results, f, indent=1)
+    print(f"Results written to {out_path}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get('scale') != results['scale']:
+            print(f"Warning: baseline was run at scale '{baseline.get('scale')}', not '{results['scale']}'")
+        if baseline.get('floor_engine', 'grid') != results['floor_engine']:
+            print(f"Warning: baseline floor cases used the '{baseline.get('floor_engine', 'grid')}' engine")
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) beyond {args.tolerance:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+        print("\nNo regressions")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+import os
+import json
+import hashlib
+
+MANIFEST_NAME = '.build-manifest.json'
+
+class BuildManifest:
+    """Records a content hash for every rendered output so unchanged pages can be skipped.
+
+    The hash covers the page's effective config, the bytes of every source image
+    and the renderer version. File digests are remembered by (mtime, size) so
+    unchanged sources are not re-read on the next run.
+    """
+
+    def __init__(self, output_dir: str, force: bool = False):
+        self.path = os.path.join(output_dir, MANIFEST_NAME)
+        self.force = force
+        self.outputs = {}
+        self.files = {}
+        self.skipped = 0
+        self.rendered = 0
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            self.outputs = data.get('outputs', {})
+            self.files = data.get('files', {})
+        except (FileNotFoundError, json.JSONDecodeError):
+            pass
+
+    def file_digest(self, path: str) -> str:
+        """Return the sha256 of a source file, reusing the stored digest if it is unchanged"""
+        stat = os.stat(path)
+        key = os.path.abspath(path)
+        entry = self.files.get(key)
+        if entry and entry[0] == stat.st_mtime and entry[1] == stat.st_size:
+            return entry[2]
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                h.update(chunk)
+        digest = h.hexdigest()
+        self.files[key] = [stat.st_mtime, stat.st_size, digest]
+        return digest
+
+    def page_key(self, page_config: dict, source_paths: list, renderer_version) -> str:
+        """Hash of a page's effective config, its source image contents and the renderer version"""
+        h = hashlib.sha256()
+        h.update(f'renderer:{renderer_version}\n'.encode())
+        h.update(json.dumps(page_config, sort_keys=True, default=str).encode())
+        for path in sorted(set(source_paths)):
+            try:
+                digest = self.file_digest(path)
+            except OSError:
+                digest = 'missing'
+            h.update(f'\n{path}:{digest}'.encode())
+        return h.hexdigest()
+
+    def is_current(self, output_path: str, key: str) -> bool:
+        """True if output_path exists and was built from the same key"""
+        if self.force:
+            return False
+        return self.outputs.get(os.path.normpath(output_path)) == key and os.path.exists(output_path)
+
+    def record(self, output_path: str, key: str):
+        self.outputs[os.path.normpath(output_path)] = key
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'outputs': self.outputs, 'files': self.files}, f, indent=1)
+        os.replace(tmp_path, self.path)
+
+    def summary(self) -> str:
+        return f"Build cache: {self.rendered} rendered, {self.skipped} up to date"
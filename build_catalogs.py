@@ -0,0 +1,430 @@
+import os
+import glob
+import json
+import time
+import signal
+import argparse
+from dataclasses import dataclass, field
+from concurrent.futures import ProcessPoolExecutor, Future, wait, FIRST_COMPLETED
+from reportlab.lib.pagesizes import A4
+from build_cache import BuildManifest
+from image_cache import shared_cache, DEFAULT_CACHE_MB
+from derivative_cache import derivatives, config_derivatives
+from profiler import profiler, add_profile_argument
+from file_watcher import FileWatcher
+from output_encoder import add_encoder_arguments, encoder_from_args
+import visualize_wall
+import visualize_floor
+import make_catalog
+
+CONFIG_GLOB = 'catalog/*.json'
+WATCH_INTERVAL = 1.0
+
+def config_type(config) -> str | None:
+    """Which tool a catalog JSON config is for: 'wall', 'floor', 'catalog' (make_catalog) or None"""
+    pages = config.get('pages') if isinstance(config, dict) else None
+    if not isinstance(pages, list) or not pages:
+        return None
+    if 'rows' in config and 'cols' in config and all(isinstance(page, dict) and 'file' in page for page in pages):
+        return 'floor'
+    if 'image_path' in config and all(isinstance(page, list) for page in pages):
+        return 'catalog'
+    if all(isinstance(page, dict) for page in pages) and any('images' in page for page in pages):
+        return 'wall'
+    return None
+
+@dataclass
+class Task:
+    """One node of the build graph, run in a pool worker once all of its deps are done.
+
+    Tasks with inputs get the results of those tasks (failed or empty ones
+    dropped) as their first argument; inputs are deps too.
+    """
+    name: str
+    fn: object
+    args: tuple = ()
+    deps: list = field(default_factory=list)
+    inputs: list | None = None
+    output: str | None = None  # File the task writes; page images are recorded in manifest under key
+    extra_outputs: list = field(default_factory=list)  # Further images a page task writes (floor "outputs")
+    key: str | None = None
+    manifest: BuildManifest | None = None
+    sources: set = field(default_factory=set)  # Every file a PDF is built from, including its config
+    ran: bool = False
+    result: object = None
+    error: str | None = None
+    done: bool = False
+
+class BuildGraph:
+    """Page renders and PDF assemblies for a set of catalog configs.
+
+    A page that several configs define identically (same output file, same
+    build key) becomes one shared task. Pages already up to date in their
+    output directory's build manifest start out done. When two configs define
+    the same output file differently, the later definition is rendered only
+    after every PDF that reads the earlier one has been written. encoders maps
+    'wall' and 'floor' to the EncoderSettings their pages are saved with, and
+    wall pages bigger than max_memory bytes are rendered in bands.
+    """
+
+    def __init__(self, force: bool = False, encoders: dict | None = None, max_memory: int | None = None):
+        self.force = force
+        self.encoders = encoders or {}
+        self.max_memory = max_memory
+        self.tasks = {}
+        self.manifests = {}
+        self.outputs = {}  # output path -> (task name, build key) of its latest definition
+        self.readers = {}  # output path -> PDF tasks reading the latest definition
+        self.watched = set()  # Absolute paths of every config and source file
+        self.references = 0
+        self.shared = 0
+        self.conflicts = []
+
+    def manifest(self, output_dir: str) -> BuildManifest:
+        output_dir = os.path.normpath(output_dir)
+        if output_dir not in self.manifests:
+            os.makedirs(output_dir, exist_ok=True)
+            self.manifests[output_dir] = BuildManifest(output_dir, force=self.force)
+        return self.manifests[output_dir]
+
+    def add(self, task: Task) -> str:
+        self.tasks[task.name] = task
+        return task.name
+
+    def page(self, output_path: str, sources: list, page_config: dict, version, fn, args: tuple, deps: list = (),
+             extra_outputs: list = ()) -> str:
+        """Name of the task rendering output_path, reusing an identical task from another config
+        extra_outputs are further files the same task writes; the page is only
+        up to date when all of them are.
+        """
+        self.references += 1
+        output_path = os.path.normpath(output_path)
+        extra_outputs = [os.path.normpath(path) for path in extra_outputs]
+        manifest = self.manifest(os.path.dirname(output_path))
+        key = manifest.page_key(page_config, sources, version)
+        current = self.outputs.get(output_path)
+        if current and current[1] == key:
+            self.shared += 1
+            return current[0]
+
+        task = Task(f"page {len(self.tasks)}: {output_path}", fn, args, list(deps), output=output_path,
+                    extra_outputs=extra_outputs, key=key, manifest=manifest)
+        if current:
+            self.conflicts.append(output_path)
+            task.deps += [current[0]] + self.readers.get(output_path, [])
+        elif all(manifest.is_current(path, key) for path in [output_path] + extra_outputs):
+            manifest.skipped += 1
+            task.done = True
+            task.result = output_path
+        self.outputs[output_path] = (task.name, key)
+        self.readers[output_path] = []
+        return self.add(task)
+
+    def pdf(self, pdf_path: str, page_tasks: list, fn, args: tuple = (), deps: list = (), sources: list = ()) -> str:
+        """Name of the task assembling pdf_path from the results of page_tasks"""
+        task = Task(f"pdf: {pdf_path}", fn, args, deps=list(deps) + list(page_tasks), inputs=list(page_tasks),
+                    output=os.path.normpath(pdf_path), sources={os.path.abspath(path) for path in sources})
+        self.watched |= task.sources
+        for name in page_tasks:
+            output = self.tasks[name].output
+            if output:
+                self.readers[output].append(task.name)
+        return self.add(task)
+
+    def add_wall(self, config_path: str, config: dict):
+        encoder = self.encoders.get('wall', visualize_wall.WALL_ENCODER)
+        options = visualize_wall.wall_pdf_options(config)
+        pages = []
+        for page in config['pages']:
+            if not page.get('images'):
+                continue  # Nothing is rendered for pages without images
+            output = os.path.join(visualize_wall.WALL_OUTPUT_PATH, f"{page['title']}.jpg")
+            pages.append(self.page(output, visualize_wall.wall_page_sources(page),
+                                   visualize_wall.wall_page_config(page, encoder),
+                                   visualize_wall.WALL_RENDERER_VERSION, visualize_wall.render_wall_page,
+                                   (page, visualize_wall.WALL_OUTPUT_PATH, None, encoder, self.max_memory)))
+        title = config.get('title', visualize_wall.DEFAULT_PDF_TITLE)
+        sources = [path for page in config['pages'] if page.get('images') for path in visualize_wall.wall_page_sources(page)]
+        if options['cover_image_path']:
+            sources.append(options['cover_image_path'])
+        pdf_path = visualize_wall.wall_pdf_path(config_path, options['print_ready'], options['page_count'])
+        self.pdf(pdf_path, pages, _wall_pdf, (pdf_path, title, options), sources=[config_path] + sources)
+
+    def add_floor(self, config_path: str, config: dict):
+        rows, cols = config['rows'], config['cols']
+        engine = config.get('engine', 'grid')
+        encoder = self.encoders.get('floor', visualize_floor.FLOOR_ENCODER)
+        os.makedirs(visualize_floor.IMAGE_OUTPUT_PATH, exist_ok=True)
+        # Check every page's outputs before adding any task, so a bad config adds nothing
+        page_variants = [visualize_floor.floor_page_variants(page) for page in config['pages']]
+        pages = []
+        for page, variants in zip(config['pages'], page_variants):
+            deps = []
+            if engine == 'grid':
+                # Build the perspective tables once before the pages that warp with them, instead of once per worker
+                size = (cols * visualize_floor.FLOOR_TILE_SIZE, rows * visualize_floor.FLOOR_TILE_SIZE)
+                for depth in dict.fromkeys(variant['depth'] for variant in variants):
+                    name = f"remap tables: {size[0]}x{size[1]} depth {depth:g}"
+                    if name not in self.tasks:
+                        self.add(Task(name, _build_remap_tables, (*size, depth)))
+                    deps.append(name)
+            pages.append(self.page(variants[0]['path'], [page['file']],
+                                   visualize_floor.floor_page_config(page, rows, cols, engine, encoder),
+                                   visualize_floor.FLOOR_RENDERER_VERSION, visualize_floor.process_page,
+                                   (page, rows, cols, engine, encoder), deps, [variant['path'] for variant in variants[1:]]))
+        self.pdf(config['output_pdf'], pages, visualize_floor.make_pdf, (config['output_pdf'], config['title']),
+                 sources=[config_path] + [page['file'] for page in config['pages']])
+
+    def add_catalog(self, config_path: str, config: dict):
+        # Thumbnails are built into the derivative cache in parallel; the PDF then reads them back
+        deps = []
+        wanted = config_derivatives(config)
+        for path, operation, size in wanted:
+            name = f"derivative: {path} {operation} {size}"
+            if name not in self.tasks:
+                self.add(Task(name, _build_derivative, (path, operation, size)))
+            deps.append(name)
+        self.pdf(config['output_pdf'], [], _catalog_pdf, (config,), deps=deps,
+                 sources=[config_path] + [path for path, _, _ in wanted])
+
+    def skip_unchanged(self, changed: set):
+        """Leave out PDFs whose pages are all up to date and none of whose sources are in changed"""
+        changed = {os.path.abspath(path) for path in changed}
+        for task in self.tasks.values():
+            if task.inputs is None or task.done or task.sources & changed or not os.path.exists(task.output):
+                continue
+            if all(self.tasks[name].done for name in task.inputs):
+                task.done = True
+                task.result = task.output
+
+def _wall_pdf(paths, pdf_path, title, options):
+    visualize_wall.generate_pdf(paths, pdf_path, title=title, **options)
+    return pdf_path
+
+def _catalog_pdf(_, config):
+    make_catalog.generate_catalog(config, make_catalog.LayoutConfig(page_width=A4[0], page_height=A4[1]))
+    return config['output_pdf']
+
+def _build_derivative(path, operation, size):
+    derivatives.get(path, operation, size)
+
+def _build_remap_tables(width, height, depth_factor):
+    # apply_perspective clamps the depth the same way before looking the tables up
+    visualize_floor.perspective_remap_tables(width, height, max(1.0, min(3.0, depth_factor)))
+
+def _run_task(fn, *args):
+    """Run one task in a pool worker, returning (result, error, profile events) instead of raising"""
+    try:
+        result, error = fn(*args), None
+    except Exception as e:
+        result, error = None, str(e)
+    # Pool workers exit without running atexit handlers
+    derivatives.save_index()
+    return result, error, profiler.take_events()
+
+def _init_worker(cache_bytes, profile=False):
+    # Ctrl+C is handled by the parent, which shuts the pool down
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    visualize_wall._init_page_worker(cache_bytes, profile)
+
+def start_pool(jobs: int) -> ProcessPoolExecutor | None:
+    """Worker processes for run_graph (None runs tasks inline when jobs is 1)"""
+    if jobs <= 1:
+        return None
+    return ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker,
+                               initargs=(shared_cache.max_bytes, profiler.enabled))
+
+def run_graph(graph: BuildGraph, jobs: int = 1, executor: ProcessPoolExecutor | None = None):
+    """Run every task of the graph once its deps are done, at most 2 * jobs in flight.
+
+    PDF assemblies are started ahead of page renders so finished catalogs are
+    written (and their pages freed) as early as possible. Helper tasks no
+    remaining task depends on are dropped. A failed page is reported and left
+    out of the PDFs that use it. A pool passed in is left running for the next
+    run (watch mode keeps its workers' caches warm that way).
+    """
+    own_executor = executor is None
+    if own_executor:
+        executor = start_pool(jobs)
+
+    def submit(task):
+        args = task.args
+        future = Future()
+        if task.inputs is not None:
+            results = [graph.tasks[name].result for name in task.inputs if graph.tasks[name].result]
+            if task.inputs and not results:
+                future.set_result((None, 'none of its pages were rendered', []))
+                return future
+            args = (results, *args)
+        if executor:
+            return executor.submit(_run_task, task.fn, *args)
+        future.set_result(_run_task(task.fn, *args))
+        return future
+
+    needed = {name for task in graph.tasks.values() if not task.done for name in task.deps}
+    for task in graph.tasks.values():
+        if task.output is None and task.name not in needed:
+            task.done = True
+
+    pending = [task for task in graph.tasks.values() if not task.done]
+    running = {}
+    try:
+        while pending or running:
+            ready = [task for task in pending if all(graph.tasks[name].done for name in task.deps)]
+            ready.sort(key=lambda task: task.inputs is None)
+            for task in ready[:2 * max(1, jobs) - len(running)]:
+                pending.remove(task)
+                running[submit(task)] = task
+            if not running:
+                raise RuntimeError(f"Build graph has a cycle: {', '.join(task.name for task in pending)}")
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                task = running.pop(future)
+                try:
+                    task.result, task.error, events = future.result()
+                    profiler.merge(events)
+                except Exception as e:
+                    # The worker itself died (e.g. killed by the OS)
+                    task.error = str(e)
+                task.done = True
+                task.ran = True
+                if task.error is not None:
+                    print(f"Error in {task.name}: {task.error}")
+                elif task.key and task.result:
+                    for path in [task.output] + task.extra_outputs:
+                        task.manifest.record(path, task.key)
+                    task.manifest.rendered += 1
+    finally:
+        if executor and own_executor:
+            executor.shutdown(cancel_futures=True)
+        for manifest in graph.manifests.values():
+            manifest.save()
+
+def load_graph(config_paths: list, force: bool = False, encoders: dict | None = None,
+               max_memory: int | None = None) -> BuildGraph:
+    """Read every config and add its tasks to a new BuildGraph (configs that cannot be read are skipped)"""
+    graph = BuildGraph(force=force, encoders=encoders, max_memory=max_memory)
+    for config_path in config_paths:
+        graph.watched.add(os.path.abspath(config_path))
+        try:
+            with open(config_path) as f:
+                config = json.load(f)
+            kind = config_type(config)
+            if kind is None:
+                print(f"Skipping {config_path}: not a wall, floor or catalog config")
+                continue
+            getattr(graph, f'add_{kind}')(config_path, config)
+            print(f"{config_path}: {kind}, {len(config['pages'])} pages")
+        except (OSError, json.JSONDecodeError, KeyError, TypeError, ValueError) as e:
+            print(f"Skipping {config_path}: {e}")
+    return graph
+
+def build_catalogs(config_paths: list, jobs: int = 1, force: bool = False, changed: set | None = None,
+                   executor: ProcessPoolExecutor | None = None, graph: BuildGraph | None = None,
+                   encoders: dict | None = None, max_memory: int | None = None) -> BuildGraph:
+    """Build the page images and PDF of every config in one run
+    Args:
+        config_paths: Catalog JSON configs of any type (wall, floor, make_catalog)
+        jobs: Worker processes shared by all configs
+        force: Re-render every page even if its output is up to date
+        changed: Files known to have changed since the last run; when given, only
+            the PDFs that use one of them or have a page to re-render are rebuilt
+        executor: Worker pool to reuse (see run_graph)
+        graph: Graph already loaded from config_paths with load_graph
+        encoders: EncoderSettings for 'wall' and 'floor' pages (see BuildGraph)
+        max_memory: Bytes above which wall pages are rendered in bands
+    Returns:
+        The finished BuildGraph
+    """
+    if graph is None:
+        graph = load_graph(config_paths, force, encoders, max_memory)
+    if changed is not None:
+        graph.skip_unchanged(changed)
+
+    renders = sum(1 for task in graph.tasks.values() if task.key and not task.done)
+    print(f"{graph.references} page references: {graph.references - graph.shared} unique pages, "
+          f"{renders} to render")
+    for output in dict.fromkeys(graph.conflicts):
+        print(f"Warning: {output} is defined differently by several configs; rendering each in turn")
+
+    run_graph(graph, jobs, executor)
+    return graph
+
+def report(graph: BuildGraph, elapsed: float, jobs: int):
+    pdfs = [task for task in graph.tasks.values() if task.inputs is not None]
+    built = [task for task in pdfs if task.ran and task.error is None]
+    failed = [task for task in graph.tasks.values() if task.error is not None]
+    for manifest in graph.manifests.values():
+        print(f"{os.path.dirname(manifest.path)}: {manifest.summary()}")
+    print(f"Built {len(built)} of {len(pdfs)} PDFs in {elapsed:.2f}s with {jobs} jobs"
+          + (f"; {len(failed)} tasks failed" if failed else ""))
+
+def watch(config_paths: list, jobs: int = 1, force: bool = False, interval: float = WATCH_INTERVAL,
+          encoders: dict | None = None, max_memory: int | None = None):
+    """Build, then rebuild whatever a change to a config or source image affects, until interrupted"""
+    executor = start_pool(jobs)
+    changed = None
+    try:
+        while True:
+            start = time.perf_counter()
+            graph = load_graph(config_paths, force, encoders, max_memory)
+            # Snapshot before building so edits made during the build trigger the next one
+            watcher = FileWatcher(graph.watched, interval)
+            build_catalogs(config_paths, jobs, changed=changed, executor=executor, graph=graph)
+            report(graph, time.perf_counter() - start, jobs)
+            force = False
+
+            print(f"Watching {len(watcher.paths)} files ({watcher.mode}); press Ctrl+C to stop")
+            changed = watcher.wait()
+            for path in sorted(changed):
+                print(f"Changed: {os.path.relpath(path)}")
+    except KeyboardInterrupt:
+        print("Stopped watching")
+    finally:
+        if executor:
+            executor.shutdown(cancel_futures=True)
+
+def main():
+    parser = argparse.ArgumentParser(description='Build every catalog config (wall, floor and make_catalog) in one run')
+    parser.add_argument('configs', nargs='*', help=f'Catalog JSON configs (default: {CONFIG_GLOB})')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1, metavar='N',
+                        help='Worker processes shared by all configs (default: all CPUs)')
+    parser.add_argument('--force', action='store_true',
+                        help='Re-render every page even if its output is up to date')
+    parser.add_argument('--cache-mb', type=int, default=DEFAULT_CACHE_MB,
+                        help=f'Memory budget in MB for decoded source images, per worker (default: {DEFAULT_CACHE_MB})')
+    parser.add_argument('--watch', action='store_true',
+                        help='Keep running and rebuild the pages and PDFs affected by every saved change')
+    parser.add_argument('--interval', type=float, default=WATCH_INTERVAL, metavar='SECONDS',
+                        help=f'With --watch, how often to poll for changes when watchdog is not installed '
+                             f'(default: {WATCH_INTERVAL:g})')
+    parser.add_argument('--max-memory', type=int, default=None, metavar='MB',
+                        help='Render wall pages bigger than this in horizontal bands (see visualize_wall.py; '
+                             'not with --min-ssim, --progressive or --optimize)')
+    add_encoder_arguments(parser)
+    add_profile_argument(parser)
+    args = parser.parse_args()
+    if args.max_memory and args.min_ssim is not None:
+        parser.error('--min-ssim compares whole pages in memory and cannot be used with --max-memory')
+    if args.max_memory and (args.progressive or args.optimize):
+        parser.error('--progressive and --optimize make libjpeg buffer the whole page and cannot be used with --max-memory')
+    max_memory = args.max_memory * 1024 * 1024 if args.max_memory else None
+    encoders = {'wall': encoder_from_args(args, quality=visualize_wall.WALL_JPEG_QUALITY),
+                'floor': encoder_from_args(args)}
+
+    if args.profile is not None:
+        profiler.enable()
+    shared_cache.set_budget(args.cache_mb * 1024 * 1024)
+    config_paths = args.configs or sorted(glob.glob(CONFIG_GLOB))
+
+    if args.watch:
+        watch(config_paths, args.jobs, args.force, args.interval, encoders, max_memory)
+    else:
+        start = time.perf_counter()
+        graph = build_catalogs(config_paths, args.jobs, args.force, encoders=encoders, max_memory=max_memory)
+        report(graph, time.perf_counter() - start, args.jobs)
+    profiler.report(args.profile, 'build_catalogs')
+
+if __name__ == "__main__":
+    main()
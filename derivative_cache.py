@@ -0,0 +1,272 @@
+import os
+import json
+import math
+import atexit
+import hashlib
+import argparse
+import threading
+from PIL import Image
+from image_loader import load_images
+
+DERIVATIVE_CACHE_PATH = './out/cache/derivatives/'
+DEFAULT_DERIVATIVE_MB = 1024
+INDEX_NAME = 'sources.json'
+# Bump whenever an operation below changes so stale derivatives are not served
+DERIVATIVE_VERSION = 2
+
+# Modes PNG stores losslessly; anything else is computed but not cached
+PNG_MODES = ('1', 'L', 'LA', 'P', 'RGB', 'RGBA', 'I', 'I;16')
+
+# Operation -> (image_loader fit, resample filter)
+OPERATIONS = {
+    'resize': ('exact', Image.BICUBIC),      # resize to exactly size
+    'thumbnail': ('contain', Image.BICUBIC), # Image.thumbnail(size)
+    'fit': ('exact', Image.LANCZOS),         # resize to exactly size, sharper filter
+}
+
+class DerivativeCache:
+    """On-disk store of resized versions of source images.
+
+    Derivatives are keyed by the source's content hash, the operation and the
+    target size, and stored as lossless PNG. The store is capped at max_bytes;
+    files are touched on every hit and the least recently used are deleted
+    first. Source hashes are remembered by (mtime, size) in an index file.
+    """
+
+    def __init__(self, cache_dir: str = DERIVATIVE_CACHE_PATH, max_bytes: int = DEFAULT_DERIVATIVE_MB * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.enabled = True
+        self.hits = 0
+        self.misses = 0
+        self._sources = None
+        self._sources_dirty = False
+        self._total_bytes = None
+        self._lock = threading.Lock()
+
+    def _load_index(self):
+        if self._sources is None:
+            try:
+                with open(os.path.join(self.cache_dir, INDEX_NAME)) as f:
+                    self._sources = json.load(f)
+            except (FileNotFoundError, json.JSONDecodeError):
+                self._sources = {}
+            atexit.register(self.save_index)
+
+    def save_index(self):
+        with self._lock:
+            if not self._sources_dirty:
+                return
+            os.makedirs(self.cache_dir, exist_ok=True)
+            path = os.path.join(self.cache_dir, INDEX_NAME)
+            # Keep digests other processes saved since this one loaded the index
+            try:
+                with open(path) as f:
+                    self._sources = dict(json.load(f), **self._sources)
+            except (FileNotFoundError, json.JSONDecodeError):
+                pass
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, 'w') as f:
+                json.dump(self._sources, f)
+            os.replace(tmp, path)
+            self._sources_dirty = False
+
+    def source_digest(self, path: str) -> str:
+        """sha256 of a source file, reusing the stored digest while its mtime and size are unchanged"""
+        stat = os.stat(path)
+        key = os.path.abspath(path)
+        with self._lock:
+            self._load_index()
+            entry = self._sources.get(key)
+        if entry and entry[0] == stat.st_mtime and entry[1] == stat.st_size:
+            return entry[2]
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                h.update(chunk)
+        digest = h.hexdigest()
+        with self._lock:
+            self._sources[key] = [stat.st_mtime, stat.st_size, digest]
+            self._sources_dirty = True
+        return digest
+
+    def derivative_path(self, path: str, operation: str, size: tuple) -> str:
+        digest = self.source_digest(path)
+        name = f"{digest[:40]}-{operation}-{size[0]}x{size[1]}-v{DERIVATIVE_VERSION}.png"
+        return os.path.join(self.cache_dir, digest[:2], name)
+
+    def get(self, path: str, operation: str, size: tuple) -> Image.Image:
+        """Return the source image at path after operation(size), from the store when possible
+        Args:
+            path: Source image file
+            operation: One of OPERATIONS ('resize', 'thumbnail', 'fit')
+            size: Target (width, height); fractional sizes are floored
+        Returns:
+            Loaded PIL Image (the caller may modify it)
+        """
+        return self.get_many(path, [(operation, size)])[0]
+
+    def get_many(self, path: str, variants: list) -> list:
+        """Return several derivatives of one source, building all missing ones from a single decode
+        Args:
+            variants: [(operation, size), ...]
+        Returns:
+            One loaded PIL Image per variant, in order
+        """
+        variants = [(operation, tuple(int(math.floor(v)) for v in size)) for operation, size in variants]
+        if not self.enabled:
+            return self.build(path, variants)
+
+        results = [None] * len(variants)
+        missing = []
+        for i, (operation, size) in enumerate(variants):
+            cached = self.derivative_path(path, operation, size)
+            try:
+                with Image.open(cached) as img:
+                    img.load()
+                os.utime(cached)  # Mark as recently used
+                self.hits += 1
+                results[i] = img
+            except OSError:
+                missing.append((i, cached))
+
+        if missing:
+            self.misses += len(missing)
+            built = self.build(path, [variants[i] for i, _ in missing])
+            for (i, cached), img in zip(missing, built):
+                if img.mode in PNG_MODES:
+                    self._store(img, cached)
+                results[i] = img
+        return results
+
+    def build(self, path: str, variants: list) -> list:
+        """Compute derivatives from the source, decoding it once"""
+        return load_images(path, [(size, *OPERATIONS[operation]) for operation, size in variants])
+
+    def _store(self, img: Image.Image, cached: str):
+        os.makedirs(os.path.dirname(cached), exist_ok=True)
+        tmp = f"{cached}.{os.getpid()}.{threading.get_ident()}.tmp"
+        img.save(tmp, format='PNG', compress_level=1)
+        os.replace(tmp, cached)
+        with self._lock:
+            if self._total_bytes is None:
+                self._total_bytes = sum(size for _, size, _ in self._files())
+            else:
+                self._total_bytes += os.path.getsize(cached)
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _files(self):
+        """(path, size, last used) of every stored derivative"""
+        if not os.path.isdir(self.cache_dir):
+            return
+        for sub in os.scandir(self.cache_dir):
+            if sub.is_dir():
+                for entry in os.scandir(sub.path):
+                    if entry.name.endswith('.png'):
+                        stat = entry.stat()
+                        yield entry.path, stat.st_size, stat.st_mtime
+
+    def _evict(self):
+        # Drop least recently used files until the store is back under 90% of the cap
+        files = sorted(self._files(), key=lambda item: item[2])
+        total = sum(size for _, size, _ in files)
+        for path, size, _ in files:
+            if total <= self.max_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+        self._total_bytes = total
+
+    def trim(self):
+        """Evict least recently used derivatives if the store is over its cap"""
+        with self._lock:
+            if sum(size for _, size, _ in self._files()) > self.max_bytes:
+                self._evict()
+
+    def clear(self):
+        for path, _, _ in list(self._files()):
+            os.remove(path)
+        self._total_bytes = 0
+
+    def stats(self) -> dict:
+        files = list(self._files())
+        return {'files': len(files), 'bytes': sum(size for _, size, _ in files), 'max_bytes': self.max_bytes}
+
+    def summary(self) -> str:
+        return f"Derivative cache: {self.hits} hits, {self.misses} built"
+
+# Shared by every tool in the process
+derivatives = DerivativeCache()
+
+def config_derivatives(config: dict) -> list:
+    """The (path, operation, size) derivatives a catalog JSON config will ask for"""
+    wanted = []
+    if 'rows' in config and 'cols' in config:
+        # visualize_floor.py --json: floor tile and page thumbnail
+        from visualize_floor import FLOOR_TILE_SIZE, THUMB_SIZE
+        for page in config.get('pages', []):
+            wanted.append((page['file'], 'resize', (FLOOR_TILE_SIZE, FLOOR_TILE_SIZE)))
+            wanted.append((page['file'], 'thumbnail', THUMB_SIZE))
+    elif 'image_path' in config:
+        # make_catalog.py: one thumbnail size per catalog
+        from reportlab.lib.pagesizes import A4
+        from make_catalog import LayoutConfig, image_cell_size
+        size = image_cell_size(LayoutConfig(page_width=A4[0], page_height=A4[1]))
+        for page in config.get('pages', []):
+            for image_data in page:
+                image_file = image_data['file'] if isinstance(image_data, dict) else image_data
+                wanted.append((os.path.join(config['image_path'], image_file), 'thumbnail', size))
+    return wanted
+
+def warm(config_paths: list, cache: DerivativeCache = derivatives, jobs: int = 1):
+    """Build every derivative the given catalog configs need that is not stored yet"""
+    from concurrent.futures import ThreadPoolExecutor
+    wanted = []
+    for config_path in config_paths:
+        try:
+            with open(config_path) as f:
+                wanted += config_derivatives(json.load(f))
+        except (OSError, json.JSONDecodeError, KeyError, TypeError) as e:
+            print(f"Skipping {config_path}: {e}")
+    wanted = list(dict.fromkeys(wanted))
+
+    def build(item):
+        try:
+            cache.get(*item)
+        except Exception as e:
+            print(f"Error building derivative of {item[0]}: {e}")
+
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        list(executor.map(build, wanted))
+    cache.save_index()
+    print(f"{len(wanted)} derivatives: {cache.misses} built, {cache.hits} already cached")
+
+def main():
+    parser = argparse.ArgumentParser(description='Manage the on-disk cache of resized source images')
+    parser.add_argument('command', choices=('warm', 'stats', 'clear'),
+                        help='warm: pre-build derivatives for catalog configs; stats: show cache size; clear: delete all')
+    parser.add_argument('configs', nargs='*', help='Catalog JSON configs to warm (e.g. catalog/*.json)')
+    parser.add_argument('--max-mb', type=int, default=DEFAULT_DERIVATIVE_MB,
+                        help=f'Size cap of the cache in MB (default: {DEFAULT_DERIVATIVE_MB})')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1, metavar='N',
+                        help='Derivatives built in parallel (default: all CPUs)')
+    args = parser.parse_args()
+
+    derivatives.max_bytes = args.max_mb * 1024 * 1024
+    if args.command == 'warm':
+        if not args.configs:
+            parser.error('warm needs at least one config file')
+        warm(args.configs, jobs=args.jobs)
+    elif args.command == 'clear':
+        derivatives.clear()
+        print(f"Cleared {DERIVATIVE_CACHE_PATH}")
+    derivatives.trim()
+    stats = derivatives.stats()
+    print(f"{stats['files']} derivatives, {stats['bytes'] / 1024 / 1024:.1f} of {stats['max_bytes'] / 1024 / 1024:.0f} MB")
+
+if __name__ == "__main__":
+    main()
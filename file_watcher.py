@@ -0,0 +1,80 @@
+import os
+import time
+import threading
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:  # Optional: poll instead
+    Observer = None
+
+# Editors often save in several writes (or write a temp file and rename it), so wait for them to finish
+SETTLE_SECONDS = 0.2
+# With watchdog, still re-check this often in case an event was missed (e.g. on network drives)
+WATCHDOG_RECHECK_SECONDS = 5.0
+
+if Observer is not None:
+    class _WakeupHandler(FileSystemEventHandler):
+        def __init__(self, wakeup: threading.Event):
+            super().__init__()
+            self.wakeup = wakeup
+
+        def on_any_event(self, event):
+            self.wakeup.set()
+
+def _stat(path: str):
+    try:
+        stat = os.stat(path)
+        return stat.st_mtime_ns, stat.st_size
+    except OSError:
+        return None
+
+class FileWatcher:
+    """Waits for changes to a fixed set of files.
+
+    Wakes up on file system events when watchdog is installed and polls every
+    interval seconds otherwise. Changes are always confirmed against the
+    mtime and size snapshot taken when the watcher was created, so edits made
+    between creating the watcher and calling wait() are not missed.
+    """
+
+    def __init__(self, paths, interval: float = 1.0):
+        self.paths = sorted({os.path.abspath(path) for path in paths})
+        self.interval = interval
+        self.snapshot = {path: _stat(path) for path in self.paths}
+        self._wakeup = threading.Event()
+        self._observer = None
+        if Observer is not None:
+            self._observer = Observer()
+            handler = _WakeupHandler(self._wakeup)
+            for directory in {os.path.dirname(path) for path in self.paths}:
+                if os.path.isdir(directory):
+                    self._observer.schedule(handler, directory, recursive=False)
+            self._observer.start()
+
+    @property
+    def mode(self) -> str:
+        return 'watchdog' if self._observer else f'polling every {self.interval:g}s'
+
+    def changes(self) -> set:
+        """Paths whose mtime or size differ from the snapshot (including created and deleted files)"""
+        return {path for path in self.paths if _stat(path) != self.snapshot[path]}
+
+    def wait(self) -> set:
+        """Block until at least one file has changed, then return every changed path"""
+        try:
+            while True:
+                self._wakeup.wait(WATCHDOG_RECHECK_SECONDS if self._observer else self.interval)
+                self._wakeup.clear()
+                changed = self.changes()
+                if changed:
+                    time.sleep(SETTLE_SECONDS)
+                    return changed | self.changes()
+        finally:
+            self.close()
+
+    def close(self):
+        if self._observer:
+            self._observer.stop()
+            self._observer.join()
+            self._observer = None
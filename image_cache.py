@@ -0,0 +1,100 @@
+import os
+import threading
+from collections import OrderedDict
+from PIL import Image
+from profiler import profiler
+from image_loader import load_image
+
+DEFAULT_CACHE_MB = 256
+
+def image_bytes(img: Image.Image) -> int:
+    """Memory Pillow holds for an image's pixels
+    1, L and P images take one byte per pixel and I;16 two; every other mode is
+    stored at 4 bytes per pixel, including RGB, which Pillow pads to RGBX.
+    """
+    if img.mode in ('1', 'L', 'P'):
+        pixel_bytes = 1
+    elif img.mode.startswith('I;16'):
+        pixel_bytes = 2
+    else:
+        pixel_bytes = 4
+    return img.width * img.height * pixel_bytes
+
+class ImageCache:
+    """LRU cache of decoded images keyed by (path, mtime, mode).
+
+    Cached images are shared between callers and must be treated as read-only
+    (paste them, copy them, but never draw on them directly).
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_CACHE_MB * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path: str, mode: str = 'RGB') -> Image.Image:
+        """Return the decoded image for path, decoding it only on a cache miss
+        Args:
+            path: Image file path
+            mode: PIL mode to convert to (None keeps the file's own mode)
+        Returns:
+            Decoded PIL Image
+        """
+        key = (os.path.abspath(path), os.path.getmtime(path), mode)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        with profiler.stage('decode'):
+            img = load_image(path, mode=mode)
+
+        size = image_bytes(img)
+        if size > self.max_bytes:
+            return img
+
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = (img, size)
+                self.current_bytes += size
+                self._evict()
+        return img
+
+    def set_budget(self, max_bytes: int):
+        """Change the byte budget, evicting least recently used images if needed"""
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def _evict(self):
+        while self.current_bytes > self.max_bytes and self._entries:
+            _, (_, size) = self._entries.popitem(last=False)
+            self.current_bytes -= size
+
+    def stats(self) -> dict:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': len(self._entries),
+            'bytes': self.current_bytes,
+            'max_bytes': self.max_bytes,
+        }
+
+    def summary(self) -> str:
+        return (f"Image cache: {self.hits} hits, {self.misses} misses, "
+                f"{len(self._entries)} images ({self.current_bytes / (1024 * 1024):.1f} of "
+                f"{self.max_bytes / (1024 * 1024):.0f} MB)")
+
+# Process-wide cache shared by every page rendered in a run
+shared_cache = ImageCache()
@@ -0,0 +1,112 @@
+import math
+from PIL import Image
+
+# Decode at least this many times the target size before the final resample,
+# as Image.thumbnail() does, so the DCT downscale never costs visible quality
+REDUCING_GAP = 2.0
+
+# EXIF orientation -> transpose that makes the image upright
+_ORIENTATIONS = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+# Transposes that swap width and height
+_SWAPS_AXES = (Image.Transpose.TRANSPOSE, Image.Transpose.TRANSVERSE,
+               Image.Transpose.ROTATE_90, Image.Transpose.ROTATE_270)
+
+def contain_size(source_size: tuple, box: tuple) -> tuple:
+    """Size of an image fitted inside box keeping its aspect ratio, rounded as Image.thumbnail() does"""
+    width, height = source_size
+    x, y = math.floor(box[0]), math.floor(box[1])
+    if x >= width and y >= height:
+        return width, height
+
+    def round_aspect(number, key):
+        return max(min(math.floor(number), math.ceil(number), key=key), 1)
+
+    aspect = width / height
+    if x / y >= aspect:
+        x = round_aspect(y * aspect, key=lambda n: abs(aspect - n / y))
+    else:
+        y = round_aspect(x / aspect, key=lambda n: 0 if n == 0 else abs(aspect - x / n))
+    return x, y
+
+def load_images(path: str, requests: list, mode: str | None = None) -> list:
+    """Load one or more sizes of an image from a single decode, closing the file straight away
+    JPEGs are decoded at the smallest DCT scale (1/2, 1/4 or 1/8) that keeps
+    REDUCING_GAP times the largest requested size, so decode time and memory
+    follow the output size rather than the file. EXIF orientation is applied.
+    Args:
+        path: Image file
+        requests: [(size, fit, resample), ...]. size is the target (width, height)
+            or None for the whole image; fit is 'exact' (resize to size) or
+            'contain' (fit inside size keeping the aspect ratio, never enlarging,
+            like Image.thumbnail())
+        mode: PIL mode to convert the results to (None keeps the file's own mode)
+    Returns:
+        One loaded PIL Image per request, in order
+    """
+    with Image.open(path) as img:
+        orientation = exif_orientation(img)
+        transposed = orientation in _SWAPS_AXES
+
+        # Work in the file's stored orientation, rotate at the end
+        targets = []
+        for size, fit, _ in requests:
+            if size is None:
+                targets.append(None)
+                continue
+            box = (size[1], size[0]) if transposed else tuple(size)
+            targets.append(contain_size(img.size, box) if fit == 'contain' else tuple(map(int, box)))
+
+        sized = [target for target in targets if target]
+        crop = None
+        if sized and len(sized) == len(targets):
+            need = (int(max(t[0] for t in sized) * REDUCING_GAP), int(max(t[1] for t in sized) * REDUCING_GAP))
+            drafted = img.draft(None, need)
+            if drafted:
+                crop = drafted[1]
+        img.load()
+
+    results = []
+    for target, (_, _, resample) in zip(targets, requests):
+        if target is None or (crop is None and target == img.size):
+            result = img if len(requests) == 1 else img.copy()
+        else:
+            result = img.resize(target, resample, box=crop, reducing_gap=REDUCING_GAP)
+        if orientation is not None:
+            result = result.transpose(orientation)
+        if mode and result.mode != mode:
+            result = result.convert(mode)
+        results.append(result)
+    return results
+
+def exif_orientation(img: Image.Image):
+    """Transpose that turns an open image upright, from its EXIF orientation (None if it already is)"""
+    return _ORIENTATIONS.get(img.getexif().get(0x0112))
+
+def upright_size(path) -> tuple:
+    """(width, height) of an image file (or open image) after EXIF orientation, read from its header"""
+    if isinstance(path, Image.Image):
+        return (path.height, path.width) if exif_orientation(path) in _SWAPS_AXES else path.size
+    with Image.open(path) as img:
+        return upright_size(img)
+
+def load_image(path: str, size: tuple | None = None, fit: str = 'exact', mode: str | None = None,
+               resample=Image.BICUBIC) -> Image.Image:
+    """Load an image at the size it will be used at (see load_images)
+    Args:
+        path: Image file
+        size: Target (width, height); None loads the whole image
+        fit: 'exact' or 'contain'
+        mode: PIL mode to convert to
+        resample: Filter for the final resize
+    Returns:
+        Loaded PIL Image, with the file closed
+    """
+    return load_images(path, [(size, fit, resample)], mode)[0]
@@ -1,10 +1,15 @@
+import io
 from PIL import Image
+from reportlab.lib.utils import ImageReader
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import A4
 import os
 import json
 import argparse
 from dataclasses import dataclass
+from pdf_images import PdfImageRegistry
+from profiler import profiler, add_profile_argument
+from derivative_cache import derivatives
 
 @dataclass
 class LayoutConfig:
@@ -22,21 +27,34 @@ def parse_args():
     parser = argparse.ArgumentParser(description='Generate PDF catalog from JSON config')
     parser.add_argument('--config', default="catalog/parking-tiles.json",
                        help='Path to catalog configuration JSON')
+    add_profile_argument(parser)
     return parser.parse_args()
 
 def load_config(config_path: str) -> dict:
     with open(config_path, 'r') as f:
         return json.load(f)
 
-def process_image(img_path: str, width: float, height: float) -> str | None:
-    temp_path = os.path.join(os.environ["TEMP"], f"temp_{os.path.basename(img_path)}")
+def image_cell_size(layout: LayoutConfig) -> tuple:
+    """Size in points of the square box every catalog image is fitted into"""
+    usable_width = layout.page_width - 2 * layout.page_margin
+    image_width = (usable_width - (layout.images_per_row - 1) * layout.spacing) / layout.images_per_row
+    return image_width, image_width
+
+def process_image(img_path: str, width: float, height: float) -> ImageReader | None:
+    """Thumbnail an image and encode it into an in-memory buffer for the canvas"""
     try:
-        img = Image.open(img_path)
-        img.thumbnail((width, height))
+        with Image.open(img_path) as src:
+            img_format = src.format or 'JPEG'
+        # The thumbnail comes from the derivative cache once it has been built
+        with profiler.stage('thumbnail'):
+            img = derivatives.get(img_path, 'thumbnail', (width, height))
         if img.mode == 'RGBA':
             img = img.convert('RGB')
-        img.save(temp_path)
-        return temp_path
+        buffer = io.BytesIO()
+        with profiler.stage('encode'):
+            img.save(buffer, format=img_format)
+        buffer.seek(0)
+        return ImageReader(buffer)
     except FileNotFoundError:
         print(f"Error: Image file not found: {img_path}")
         return None
@@ -58,59 +76,55 @@ def draw_header(c, layout: LayoutConfig, title: str, page_num: int, total_pages:
 def generate_catalog(config: dict, layout: LayoutConfig):
     os.makedirs(os.path.dirname(config['output_pdf']), exist_ok=True)
     c = canvas.Canvas(config['output_pdf'], pagesize=A4)
-    temp_files = []
+    # Files listed more than once are processed and embedded only once
+    registry = PdfImageRegistry(c)
 
     # Calculate image dimensions
-    usable_width = layout.page_width - 2 * layout.page_margin
-    image_width = (usable_width - (layout.images_per_row - 1) * layout.spacing) / layout.images_per_row
-    image_height = image_width
+    image_width, image_height = image_cell_size(layout)
 
     for page_num, page_images in enumerate(config['pages']):
-        draw_header(c, layout, config['title'], page_num, len(config['pages']))
+        with profiler.stage('page', page=page_num + 1):
+            draw_header(c, layout, config['title'], page_num, len(config['pages']))
         
-        for idx, image_data in enumerate(page_images):
-            # Calculate position
-            col = idx % layout.images_per_row
-            row = idx // layout.images_per_row
-            x = layout.page_margin + col * (image_width + layout.spacing)
-            y = (layout.page_height - layout.header_margin - 
-                 (row * (image_height + layout.row_spacing)))
+            for idx, image_data in enumerate(page_images):
+                # Calculate position
+                col = idx % layout.images_per_row
+                row = idx // layout.images_per_row
+                x = layout.page_margin + col * (image_width + layout.spacing)
+                y = (layout.page_height - layout.header_margin - 
+                     (row * (image_height + layout.row_spacing)))
 
-            # Handle image data format
-            if isinstance(image_data, dict):
-                image_file = image_data['file']
-                image_title = image_data.get('title', os.path.splitext(image_file)[0])
-            else:
-                image_file = image_data
-                image_title = os.path.splitext(image_data)[0]
+                # Handle image data format
+                if isinstance(image_data, dict):
+                    image_file = image_data['file']
+                    image_title = image_data.get('title', os.path.splitext(image_file)[0])
+                else:
+                    image_file = image_data
+                    image_title = os.path.splitext(image_data)[0]
 
-            # Process and draw image
-            img_path = os.path.join(config['image_path'], image_file)
-            temp_file = process_image(img_path, image_width, image_height)
-            temp_files.append(temp_file)
-            
-            c.drawImage(temp_file, x, y - image_height, image_width, image_height)
-            c.setFont("Helvetica", 10)
-            c.drawString(x, y - image_height - 15, image_title)
+                # Process and draw image
+                img_path = os.path.join(config['image_path'], image_file)
+                registry.draw(lambda: process_image(img_path, image_width, image_height),
+                              x, y - image_height, image_width, image_height,
+                              source_key=(img_path, image_width, image_height))
+                c.setFont("Helvetica", 10)
+                c.drawString(x, y - image_height - 15, image_title)
         
-        c.showPage()
+            c.showPage()
     
-    c.save()
-    cleanup_temp_files(temp_files)
-
-def cleanup_temp_files(temp_files: list):
-    for temp_file in temp_files:
-        try:
-            os.remove(temp_file)
-        except:
-            pass
+    with profiler.stage('pdf.save'):
+        c.save()
+    print(registry.summary())
 
 def main():
     args = parse_args()
+    if args.profile is not None:
+        profiler.enable()
     config = load_config(args.config)
     layout = LayoutConfig(page_width=A4[0], page_height=A4[1])
     generate_catalog(config, layout)
     print(f"Catalog generated: {config['output_pdf']}")
+    profiler.report(args.profile, 'make_catalog')
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,172 @@
+import io
+from dataclasses import dataclass, asdict
+import numpy as np
+import cv2
+from PIL import Image
+from profiler import profiler
+
+# Similarity (SSIM of the luma channel, 1.0 = identical) an adaptive encode keeps against the uncompressed render
+DEFAULT_MIN_SSIM = 0.98
+# Range the adaptive search picks a quality from
+MIN_QUALITY = 40
+MAX_QUALITY = 95
+
+ENCODER_FORMATS = {'jpeg': 'JPEG', 'webp': 'WEBP'}
+# Bump whenever the adaptive search changes so pages encoded by the old one are rebuilt
+ENCODER_VERSION = 2
+# Quality Pillow writes each format at when none is given
+DEFAULT_QUALITY = {'jpeg': 75, 'webp': 80}
+
+# SSIM constants for 8-bit images (Wang et al. 2004)
+_C1 = (0.01 * 255) ** 2
+_C2 = (0.03 * 255) ** 2
+
+@dataclass(frozen=True)
+class EncoderSettings:
+    """How a rendered image is compressed.
+
+    With min_ssim unset every image is written at quality (None uses the
+    format's own default). With min_ssim set, the lowest quality between
+    min_quality and max_quality whose decoded result keeps at least that SSIM
+    against the render is used instead. The search never goes above the fixed
+    quality, which is also the baseline the savings are reported against, so
+    adaptive files are not made larger to reach the threshold.
+    """
+    format: str = 'jpeg'
+    quality: int | None = None
+    min_ssim: float | None = None
+    min_quality: int = MIN_QUALITY
+    max_quality: int = MAX_QUALITY
+    progressive: bool = False
+    optimize: bool = False
+
+    def key(self) -> dict:
+        """Settings as a plain dict (used for build hashes)"""
+        return dict(asdict(self), version=ENCODER_VERSION)
+
+    def fixed_quality(self) -> int:
+        """Quality images are written at without min_ssim: quality, or the format's default"""
+        return self.quality if self.quality is not None else DEFAULT_QUALITY[self.format]
+
+    def save_options(self, quality: int | None) -> dict:
+        """Keyword arguments for Image.save at quality"""
+        options = {'format': ENCODER_FORMATS[self.format]}
+        if quality is not None:
+            options['quality'] = quality
+        if self.format == 'jpeg':
+            if self.progressive:
+                options['progressive'] = True
+            if self.optimize:
+                options['optimize'] = True
+        elif self.optimize:
+            options['method'] = 6  # Slowest, smallest WebP
+        return options
+
+@dataclass
+class EncodedImage:
+    data: bytes
+    quality: int | None
+    ssim: float | None = None
+    baseline_bytes: int | None = None  # Size at the settings' fixed quality, for adaptive encodes
+    baseline_quality: int | None = None
+
+    def report(self, name: str) -> str:
+        """One line with the size, and for adaptive encodes the bytes saved against the fixed quality"""
+        if self.baseline_bytes is None:
+            return f"{name}: {len(self.data) / 1024:.0f} KB"
+        saved = self.baseline_bytes - len(self.data)
+        baseline = 'default quality' if self.baseline_quality is None else f'quality {self.baseline_quality}'
+        change = (f"saved {saved / 1024:.0f} KB ({saved / self.baseline_bytes:.0%})" if saved >= 0 else
+                  f"{-saved / 1024:.0f} KB larger")
+        return (f"{name}: quality {self.quality} (SSIM {self.ssim:.4f}), {len(self.data) / 1024:.0f} KB, "
+                f"{change} vs {baseline}")
+
+class _SsimReference:
+    """Luma statistics of the uncompressed render, computed once and compared against every candidate"""
+
+    def __init__(self, image: Image.Image):
+        self.x = np.asarray(image.convert('L'), dtype=np.float32)
+        mu_x = self._blur(self.x)
+        var_x = self._blur(self.x * self.x) - mu_x * mu_x
+        # Terms of the SSIM formula that only depend on the reference
+        self.mu_x = mu_x
+        self.mu_x2 = 2 * mu_x
+        self.mu_x_sq = mu_x * mu_x + _C1
+        self.var_x = var_x + _C2
+
+    @staticmethod
+    def _blur(a: np.ndarray) -> np.ndarray:
+        return cv2.GaussianBlur(a, (11, 11), 1.5)
+
+    def ssim(self, data: bytes) -> float:
+        """Mean SSIM of an encoded candidate against the reference"""
+        with Image.open(io.BytesIO(data)) as img:
+            img.draft('L', img.size)  # Let the JPEG decoder skip the colour conversion
+            y = np.asarray(img.convert('L'), dtype=np.float32)
+        mu_y = self._blur(y)
+        mu_y_sq = mu_y * mu_y
+        var_y = self._blur(y * y) - mu_y_sq
+        cov = self._blur(self.x * y) - self.mu_x * mu_y
+        numerator = (self.mu_x2 * mu_y + _C1) * (2 * cov + _C2)
+        denominator = (self.mu_x_sq + mu_y_sq) * (self.var_x + var_y)
+        return float((numerator / denominator).mean())
+
+def _encode(image: Image.Image, settings: EncoderSettings, quality: int | None) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, **settings.save_options(quality))
+    return buffer.getvalue()
+
+def encode_image(image: Image.Image, settings: EncoderSettings) -> EncodedImage:
+    """Compress a rendered image as settings ask
+    The adaptive search is a binary search over quality, so it costs about
+    log2(max_quality - min_quality) trial encodes per image; callers render
+    pages in parallel, which spreads it across workers.
+    Args:
+        image: Uncompressed render
+        settings: Encoder settings
+    Returns:
+        EncodedImage with the chosen quality (and SSIM and baseline size when adaptive)
+    """
+    with profiler.stage('encode'):
+        if settings.min_ssim is None:
+            return EncodedImage(_encode(image, settings, settings.quality), settings.quality)
+
+        reference = _SsimReference(image)
+        high = min(settings.max_quality, settings.fixed_quality())
+        low = min(settings.min_quality, high)
+        best = None  # (quality, data, ssim) of the lowest quality known to pass
+        while low <= high:
+            quality = (low + high) // 2
+            data = _encode(image, settings, quality)
+            score = reference.ssim(data)
+            if score >= settings.min_ssim:
+                best = (quality, data, score)
+                high = quality - 1
+            else:
+                low = quality + 1
+        if best is None:
+            # Even the highest allowed quality misses the threshold; keep the closest we can get
+            data = _encode(image, settings, high)
+            best = (high, data, reference.ssim(data))
+        baseline = len(_encode(image, settings, settings.quality))
+        return EncodedImage(best[1], best[0], best[2], baseline, settings.quality)
+
+def save_image(image: Image.Image, path: str, settings: EncoderSettings) -> EncodedImage:
+    """Encode an image with encode_image and write it to path"""
+    encoded = encode_image(image, settings)
+    with open(path, 'wb') as f:
+        f.write(encoded.data)
+    return encoded
+
+def add_encoder_arguments(parser):
+    parser.add_argument('--min-ssim', nargs='?', type=float, const=DEFAULT_MIN_SSIM, default=None, metavar='SSIM',
+                        help='Save each image at the lowest quality whose SSIM against the render stays at or above '
+                             f'SSIM (default when given without a value: {DEFAULT_MIN_SSIM})')
+    parser.add_argument('--progressive', action='store_true', help='Write progressive JPEGs')
+    parser.add_argument('--optimize', action='store_true',
+                        help='Optimize JPEG Huffman tables / use the slowest WebP method (smaller, slower)')
+
+def encoder_from_args(args, **defaults) -> EncoderSettings:
+    """EncoderSettings from the add_encoder_arguments flags, on top of a tool's defaults"""
+    return EncoderSettings(**dict(defaults, min_ssim=args.min_ssim, progressive=args.progressive,
+                                  optimize=args.optimize))
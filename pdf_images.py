@@ -0,0 +1,202 @@
+import io
+import os
+import math
+import hashlib
+import contextlib
+from PIL import Image
+from reportlab import rl_config
+from reportlab.lib.utils import ImageReader
+from profiler import profiler
+from image_loader import load_image, exif_orientation, upright_size
+
+# Quality used when an image has to be re-encoded after downsampling
+RESAMPLE_QUALITY = 90
+
+class EncodedJpeg(ImageReader):
+    """ImageReader over JPEG bytes already in memory
+    reportlab names every image by hashing its decoded pixels; this names it by
+    the compressed bytes instead, so the JPEG is embedded without being decoded.
+    """
+
+    def __init__(self, data: bytes):
+        super().__init__(io.BytesIO(data))
+        self._dataA = None
+
+    def getRGBData(self):
+        return self.fp.getvalue()
+
+@contextlib.contextmanager
+def binary_streams():
+    """Embed image streams as raw binary while a PDF is built
+    ASCII85 makes them 25% bigger and, without reportlab's optional C
+    accelerator, takes most of the PDF writing time. reportlab reads the
+    setting when images are drawn and when the file is saved, so the whole
+    canvas lifetime has to be inside; works as a decorator too.
+    """
+    previous = rl_config.useA85
+    rl_config.useA85 = 0
+    try:
+        yield
+    finally:
+        rl_config.useA85 = previous
+
+def target_pixels(width_pt: float, height_pt: float, dpi: float) -> tuple:
+    """Pixel size an image needs to reach dpi when drawn at width_pt x height_pt points"""
+    return max(1, math.ceil(width_pt / 72 * dpi)), max(1, math.ceil(height_pt / 72 * dpi))
+
+def fit_image_for_pdf(img_path, width_pt: float, height_pt: float, dpi: float | None = None,
+                      quality: int = RESAMPLE_QUALITY):
+    """Prepare an image file for canvas.drawImage at its placed size
+    Images that already fit the requested resolution are returned unchanged, so
+    reportlab embeds a JPEG's original DCT stream untouched. Larger images are
+    downsampled to exactly the pixels the placed size needs at dpi; JPEG sources
+    are re-encoded as an in-memory JPEG. Photos with an EXIF orientation are
+    always decoded upright (see upright_image_for_pdf).
+    Args:
+        img_path: Source image file or EncodedJpeg
+        width_pt: Placed width in points
+        height_pt: Placed height in points
+        dpi: Target resolution (None never downsamples)
+        quality: JPEG quality for re-encoded images
+    Returns:
+        A filename or ImageReader suitable for canvas.drawImage
+    """
+    if not dpi:
+        return upright_image_for_pdf(img_path, quality)
+
+    source = io.BytesIO(img_path.fp.getvalue()) if isinstance(img_path, EncodedJpeg) else img_path
+    with Image.open(source) as img:
+        target = target_pixels(width_pt, height_pt, dpi)
+        width, height = upright_size(img)
+        if width <= target[0] and height <= target[1]:
+            return upright_image_for_pdf(img_path, quality)
+        is_jpeg = img.format == 'JPEG'
+
+    # Decode only as much of the image as the placed size needs
+    if isinstance(source, io.BytesIO):
+        source.seek(0)
+    return _reencode_for_pdf(load_image(source, target, resample=Image.LANCZOS), is_jpeg, quality)
+
+def upright_image_for_pdf(img_path, quality: int = RESAMPLE_QUALITY):
+    """Prepare an image file for canvas.drawImage the right way up
+    reportlab embeds the stored pixels and ignores EXIF orientation, so photos
+    with an orientation tag are decoded, turned upright and re-encoded. Other
+    files are returned unchanged, keeping a JPEG's DCT stream.
+    """
+    if isinstance(img_path, EncodedJpeg):
+        return img_path
+    with Image.open(img_path) as img:
+        if exif_orientation(img) is None:
+            return img_path
+        is_jpeg = img.format == 'JPEG'
+    return _reencode_for_pdf(load_image(img_path), is_jpeg, quality)
+
+def _reencode_for_pdf(image: Image.Image, is_jpeg: bool, quality: int):
+    if not is_jpeg:
+        return ImageReader(image)
+    if image.mode not in ('RGB', 'L', 'CMYK'):
+        image = image.convert('RGB')
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=quality)
+    return EncodedJpeg(buffer.getvalue())
+
+class PdfImageRegistry:
+    """Embeds each distinct image once per PDF and references it on every placement.
+
+    Images are identified by a hash of their processed content (file bytes,
+    encoded buffer or decoded pixels), so the same picture reached through
+    different paths or placements is stored once. Each unique image becomes a
+    unit-square form XObject that placements scale into position.
+    """
+
+    def __init__(self, c):
+        self.canvas = c
+        self.placements = 0
+        self.embedded = 0
+        self._names = {}  # source key -> (form name, pixel size)
+
+    def _digest(self, image) -> str:
+        h = hashlib.sha1()
+        if isinstance(image, str):
+            with open(image, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    h.update(chunk)
+        elif isinstance(image, Image.Image):
+            h.update(f'{image.mode}{image.size}'.encode())
+            h.update(image.tobytes())
+        elif isinstance(image, io.BytesIO):
+            h.update(image.getvalue())
+        elif isinstance(image, ImageReader) and isinstance(getattr(image, 'fp', None), io.BytesIO):
+            h.update(image.fp.getvalue())
+        else:
+            h.update(ImageReader(image).getRGBData())
+        return h.hexdigest()
+
+    def register(self, image, source_key=None):
+        """Embed image unless identical content is already in the PDF
+        Args:
+            image: File path, PIL Image, encoded BytesIO or ImageReader, or a
+                callable returning one (only called if source_key is unseen)
+            source_key: Optional hashable identifying how the image was produced,
+                letting repeat placements skip processing and hashing entirely
+        Returns:
+            (form name, (pixel width, pixel height)), or None if the callable
+            produced no image
+        """
+        if source_key is not None and source_key in self._names:
+            return self._names[source_key]
+        if callable(image):
+            with profiler.stage('pdf.prepare'):
+                image = image()
+        if image is None:
+            return None
+        if isinstance(image, str) and source_key is None:
+            stat = os.stat(image)
+            source_key = (os.path.abspath(image), stat.st_mtime, stat.st_size)
+            if source_key in self._names:
+                return self._names[source_key]
+
+        name = 'Img' + self._digest(image)
+        if isinstance(image, io.BytesIO):
+            image.seek(0)
+            image = ImageReader(image)
+        if name not in self._names:
+            c = self.canvas
+            with profiler.stage('pdf.embed'):
+                c.beginForm(name, 0, 0, 1, 1)
+                size = c.drawImage(image, 0, 0, 1, 1)
+                c.endForm()
+            self._names[name] = (name, size)
+            self.embedded += 1
+        entry = self._names[name]
+        if source_key is not None:
+            self._names[source_key] = entry
+        return entry
+
+    def draw(self, image, x: float, y: float, width: float, height: float,
+             preserve_aspect: bool = False, source_key=None):
+        """Place an image at (x, y) with the given size, embedding it only once
+        With preserve_aspect the image is fitted and centered in the box, like
+        drawImage(..., preserveAspectRatio=True). Returns False if there was no
+        image to draw.
+        """
+        entry = self.register(image, source_key)
+        if entry is None:
+            return False
+        name, (img_width, img_height) = entry
+        if preserve_aspect and img_width and img_height:
+            scale = min(width / img_width, height / img_height)
+            x += (width - img_width * scale) / 2
+            y += (height - img_height * scale) / 2
+            width, height = img_width * scale, img_height * scale
+        c = self.canvas
+        c.saveState()
+        c.translate(x, y)
+        c.scale(width, height)
+        c.doForm(name)
+        c.restoreState()
+        self.placements += 1
+        return True
+
+    def summary(self) -> str:
+        return f"PDF images: {self.embedded} embedded for {self.placements} placements"
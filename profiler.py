@@ -0,0 +1,134 @@
+import os
+import json
+import time
+import threading
+import contextlib
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Returned by Profiler.stage() while profiling is off, so instrumented code pays
+# for one attribute check and nothing else
+_NO_STAGE = contextlib.nullcontext()
+
+PROFILE_OUTPUT_PATH = './out/profile/'
+
+def current_rss() -> int:
+    """Resident memory of this process in bytes (peak RSS where the current value is unavailable)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    if resource is not None:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return 0
+
+class _Stage:
+    __slots__ = ('profiler', 'name', 'args', 'start', 'cpu', 'rss')
+
+    def __init__(self, profiler, name, args):
+        self.profiler = profiler
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.rss = current_rss()
+        self.cpu = time.thread_time_ns()
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter_ns()
+        cpu = time.thread_time_ns() - self.cpu
+        self.profiler.events.append((self.name, self.start, end - self.start, cpu, current_rss() - self.rss,
+                                     os.getpid(), threading.get_ident(), self.args))
+        return False
+
+class Profiler:
+    """Records wall time, CPU time and memory delta of named pipeline stages.
+
+    Stages nest and may run on any thread; worker processes hand their events
+    back with take_events() for the parent to merge(). Disabled by default.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.events = []  # (name, start ns, wall ns, cpu ns, rss delta, pid, tid, args)
+        self.started = time.perf_counter_ns()
+
+    def enable(self):
+        self.enabled = True
+        self.started = time.perf_counter_ns()
+
+    def stage(self, name: str, **args):
+        """Context manager timing one stage; extra keyword args are stored with it (e.g. page=title)"""
+        if not self.enabled:
+            return _NO_STAGE
+        return _Stage(self, name, args)
+
+    def take_events(self) -> list:
+        """Return and forget the events recorded so far (used to ship them out of worker processes)"""
+        events, self.events = self.events, []
+        return events
+
+    def merge(self, events: list):
+        self.events.extend(events)
+
+    def summary(self, top_pages: int = 5) -> str:
+        """Table of totals per stage, slowest first, followed by the slowest pages"""
+        totals = {}
+        for name, _, wall, cpu, mem, _, _, _ in self.events:
+            entry = totals.setdefault(name, [0, 0, 0, 0, 0])
+            entry[0] += 1
+            entry[1] += wall
+            entry[2] += cpu
+            entry[3] = max(entry[3], wall)
+            entry[4] += mem
+
+        elapsed = (time.perf_counter_ns() - self.started) / 1e9
+        lines = [f"Profile: {elapsed:.2f}s elapsed (stage times are inclusive of nested stages)",
+                 f"{'stage':<16}{'calls':>7}{'wall s':>10}{'cpu s':>9}{'mean ms':>10}{'max ms':>9}{'mem MB':>9}"]
+        for name, (calls, wall, cpu, longest, mem) in sorted(totals.items(), key=lambda item: -item[1][1]):
+            lines.append(f"{name:<16}{calls:>7}{wall / 1e9:>10.2f}{cpu / 1e9:>9.2f}"
+                         f"{wall / calls / 1e6:>10.1f}{longest / 1e6:>9.1f}{mem / 1024 / 1024:>9.1f}")
+
+        pages = sorted((event for event in self.events if event[0] == 'page'), key=lambda event: -event[2])
+        if pages:
+            lines.append("Slowest pages:")
+            for event in pages[:top_pages]:
+                lines.append(f"  {event[7].get('page', '?')}: {event[2] / 1e6:.0f} ms")
+        return '\n'.join(lines)
+
+    def chrome_trace(self) -> dict:
+        """Events in Chrome trace format (chrome://tracing, Perfetto), with the per-stage summary alongside"""
+        trace = []
+        for name, start, wall, cpu, mem, pid, tid, args in self.events:
+            trace.append({
+                'name': name, 'cat': 'stage', 'ph': 'X', 'pid': pid, 'tid': tid,
+                'ts': (start - self.started) / 1000, 'dur': wall / 1000,
+                'args': dict(args, cpu_ms=cpu / 1e6, mem_mb=mem / 1024 / 1024),
+            })
+        return {'traceEvents': trace, 'displayTimeUnit': 'ms', 'summary': self.summary().splitlines()}
+
+    def report(self, path: str | None, tool: str):
+        """Print the summary and write the trace to path (or a timestamped file under out/profile/)"""
+        if not self.enabled:
+            return
+        print(self.summary())
+        if not path:
+            path = os.path.join(PROFILE_OUTPUT_PATH, f"{tool}-{time.strftime('%Y%m%d_%H%M%S')}.json")
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(self.chrome_trace(), f)
+        print(f"Profile trace written to {path}")
+
+def add_profile_argument(parser):
+    parser.add_argument('--profile', nargs='?', const='', default=None, metavar='TRACE_JSON',
+                        help='Print per-stage timings and write a Chrome trace JSON '
+                             '(default: out/profile/<tool>-<timestamp>.json)')
+
+# Shared by every tool in the process
+profiler = Profiler()
@@ -0,0 +1,320 @@
+import os
+import io
+import json
+import time
+import signal
+import argparse
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from http import HTTPStatus
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+from build_cache import BuildManifest
+from image_cache import shared_cache, DEFAULT_CACHE_MB
+from derivative_cache import derivatives
+import visualize_floor
+import visualize_wall
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+DEFAULT_PREVIEW_MB = 256
+# Largest floor grid a request may ask for; bigger floors take seconds and gigabytes each
+MAX_GRID = 40
+PREVIEW_OUTPUT_PATH = './out/preview/'
+
+class RequestError(Exception):
+    def __init__(self, status: HTTPStatus, message: str):
+        super().__init__(message)
+        self.status = status
+
+def _init_worker(cache_bytes):
+    # Ctrl+C is handled by the server, which shuts the pool down
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    shared_cache.set_budget(cache_bytes)
+
+def _warm_worker(_):
+    return os.getpid()
+
+def _render(fn, *args) -> bytes:
+    try:
+        return fn(*args)
+    finally:
+        # Pool workers exit without running atexit handlers
+        derivatives.save_index()
+
+def render_floor_preview(tile: str, rows: int, cols: int, rotate: bool, padding: int, title: str, engine: str) -> bytes:
+    """Perspective floor with the tile thumbnail, as visualize_floor.py --in_file renders it, as JPEG bytes"""
+    floor = visualize_floor.render_page_floor(rows, cols, tile, rotate, padding, engine=engine)
+    final = visualize_floor.append_thumbnail(title, tile, floor, saveFile=False)
+    buffer = io.BytesIO()
+    final.save(buffer, format='JPEG')
+    return buffer.getvalue()
+
+def render_wall_preview(page: dict) -> bytes:
+    """Wall page as visualize_wall.py renders it, as JPEG bytes"""
+    result = visualize_wall.encode_wall_page(page)
+    if result is None:
+        raise ValueError('page has no images')
+    return result[0]
+
+class PreviewCache:
+    """LRU cache of rendered previews (JPEG bytes) keyed by ETag, capped at max_bytes"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self._entries = OrderedDict()
+
+    def get(self, key: str) -> bytes | None:
+        data = self._entries.get(key)
+        if data is not None:
+            self._entries.move_to_end(key)
+        return data
+
+    def put(self, key: str, data: bytes):
+        if len(data) > self.max_bytes or key in self._entries:
+            return
+        self._entries[key] = data
+        self.current_bytes += len(data)
+        while self.current_bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.current_bytes -= len(evicted)
+
+class RenderService:
+    """Renders floor and wall previews on a pool of warm worker processes.
+
+    Every preview is identified by an ETag hashed from its parameters, the
+    content of every source image and the renderer version, so the tag is known
+    before rendering: conditional requests are answered without rendering,
+    repeats come from the in-memory cache and identical requests that arrive
+    while a render is running wait for that render instead of starting another.
+    Only files under root can be read.
+    """
+
+    def __init__(self, root: str = '.', jobs: int = 1, cache_bytes: int = DEFAULT_PREVIEW_MB * 1024 * 1024,
+                 image_cache_bytes: int = DEFAULT_CACHE_MB * 1024 * 1024):
+        self.root = os.path.realpath(root)
+        self.jobs = max(1, jobs)
+        self.cache = PreviewCache(cache_bytes)
+        # Only used for page_key() and its source digests; never saved
+        self.digests = BuildManifest(os.path.join(self.root, PREVIEW_OUTPUT_PATH))
+        self.in_flight = {}
+        self.counts = {'hit': 0, 'miss': 0, 'coalesced': 0, 'not_modified': 0, 'error': 0, 'restarts': 0}
+        self._lock = threading.RLock()
+        self.image_cache_bytes = image_cache_bytes
+        self.executor = self._new_executor()
+        # Start every worker now so the first requests don't pay for it
+        list(self.executor.map(_warm_worker, [None] * self.jobs))
+
+    def _new_executor(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(max_workers=self.jobs, initializer=_init_worker, initargs=(self.image_cache_bytes,))
+
+    def _restart(self, broken: ProcessPoolExecutor):
+        """Replace a pool that lost a worker (killed or crashed); every render it still held has failed"""
+        with self._lock:
+            if self.executor is broken:  # Not already replaced by another request
+                print('A render worker died; starting a new worker pool')
+                broken.shutdown(wait=False, cancel_futures=True)
+                self.executor = self._new_executor()
+                self.counts['restarts'] += 1
+
+    def close(self):
+        self.executor.shutdown(cancel_futures=True)
+
+    def resolve(self, path: str | None, what: str) -> str:
+        """Absolute path of a file under root (relative paths are relative to root), or a RequestError"""
+        if not path:
+            raise RequestError(HTTPStatus.BAD_REQUEST, f'missing {what}')
+        full = os.path.realpath(os.path.join(self.root, path))
+        if os.path.commonpath([full, self.root]) != self.root:
+            raise RequestError(HTTPStatus.FORBIDDEN, f'{what} is outside the served directory: {path}')
+        if not os.path.isfile(full):
+            raise RequestError(HTTPStatus.NOT_FOUND, f'{what} not found: {path}')
+        return full
+
+    def floor_job(self, params: dict) -> tuple:
+        tile = self.resolve(params.get('tile'), 'tile')
+        rows = _int_param(params, 'rows', 20, 1, MAX_GRID)
+        cols = _int_param(params, 'cols', 20, 1, MAX_GRID)
+        padding = _int_param(params, 'padding', 2, 0, 50)
+        rotate = params.get('rotate', '0').lower() in ('1', 'true', 'yes', 'on')
+        title = params.get('title', os.path.splitext(os.path.basename(tile))[0])
+        engine = params.get('engine', 'grid')
+        if engine not in visualize_floor.FLOOR_ENGINES:
+            raise RequestError(HTTPStatus.BAD_REQUEST, f"engine must be one of {', '.join(visualize_floor.FLOOR_ENGINES)}")
+        # The perspective view crops fixed margins off the floor; smaller grids would come back flat
+        tile_size = visualize_floor.FLOOR_TILE_SIZE
+        if visualize_floor.perspective_transform(cols * tile_size, rows * tile_size, visualize_floor.DEPTH_FACTOR) is None:
+            left, top, right, bottom = visualize_floor.PERSPECTIVE_CROP
+            raise RequestError(HTTPStatus.BAD_REQUEST,
+                               f'a {rows}x{cols} floor is too small for the perspective view '
+                               f'(needs at least {(top + bottom) // tile_size + 1} rows and '
+                               f'{(left + right) // tile_size + 1} cols)')
+        config = {'kind': 'floor', 'rows': rows, 'cols': cols, 'padding': padding, 'rotate': rotate, 'title': title,
+                  'engine': engine, 'depth_factor': visualize_floor.DEPTH_FACTOR}
+        return (config, [tile], visualize_floor.FLOOR_RENDERER_VERSION,
+                render_floor_preview, (tile, rows, cols, rotate, padding, title, engine))
+
+    def wall_job(self, params: dict) -> tuple:
+        if 'config' in params:
+            # A page of an existing wall config, by title
+            config_path = self.resolve(params['config'], 'config')
+            try:
+                with open(config_path) as f:
+                    pages = json.load(f)['pages']
+                page = next(page for page in pages if str(page.get('title')) == params.get('page'))
+            except (json.JSONDecodeError, KeyError, TypeError):
+                raise RequestError(HTTPStatus.BAD_REQUEST, f"not a wall config: {params['config']}")
+            except StopIteration:
+                raise RequestError(HTTPStatus.NOT_FOUND, f"no page titled {params.get('page')!r} in {params['config']}")
+        else:
+            page = {'title': params.get('title', 'preview'), 'path': params.get('path', '')}
+            for name in ('images', 'images_random', 'footer'):
+                if params.get(name):
+                    page[name] = [item for item in params[name].split(',') if item]
+            for name, default, high in (('cols', 5, MAX_GRID), ('padding', 3, 50), ('title_padding', 30, 1000)):
+                page[name] = _int_param(params, name, default, 0 if name != 'cols' else 1, high)
+        if not page.get('images'):
+            raise RequestError(HTTPStatus.BAD_REQUEST, 'missing images')
+
+        # Image folders are relative to root, like the paths in catalog configs
+        page = dict(page, path=os.path.join(self.root, page.get('path', '')))
+        sources = [self.resolve(path, 'image') for path in visualize_wall.wall_page_sources(page)]
+        config = dict(visualize_wall.wall_page_config(page), kind='wall')
+        return config, sources, visualize_wall.WALL_RENDERER_VERSION, render_wall_preview, (page,)
+
+    def prepare(self, kind: str, params: dict) -> tuple:
+        """Parse a request into (etag, render function, args) without rendering anything"""
+        config, sources, version, fn, args = self.floor_job(params) if kind == 'floor' else self.wall_job(params)
+        return f'"{self.digests.page_key(config, sources, version)[:40]}"', fn, args
+
+    def get(self, etag: str, fn, args: tuple, retry: bool = True) -> tuple:
+        """Return (JPEG bytes, 'hit' | 'miss' | 'coalesced') for a prepared request, rendering it if needed
+        If a worker dies, the pool is replaced and the render is tried once more.
+        """
+        with self._lock:
+            data = self.cache.get(etag)
+            if data is not None:
+                self.counts['hit'] += 1
+                return data, 'hit'
+            executor = self.executor
+            future, owner = self.in_flight.get(etag, (None, None))
+            if owner is executor:
+                how = 'coalesced'
+            else:  # Nothing running, or left over from a pool that has been replaced
+                how = 'miss'
+                try:
+                    future = executor.submit(_render, fn, *args)
+                except BrokenProcessPool:
+                    self._restart(executor)
+                    executor = self.executor
+                    future = executor.submit(_render, fn, *args)
+                self.in_flight[etag] = (future, executor)
+                future.add_done_callback(lambda done: self._finish(etag, done))
+            self.counts[how] += 1
+        try:
+            return future.result(), how
+        except BrokenProcessPool:
+            if not retry:
+                raise
+            self._restart(executor)
+            return self.get(etag, fn, args, retry=False)
+
+    def _finish(self, etag: str, future):
+        with self._lock:
+            if self.in_flight.get(etag, (None,))[0] is future:
+                self.in_flight.pop(etag)
+            if not future.cancelled() and future.exception() is None:
+                self.cache.put(etag, future.result())
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self.counts, jobs=self.jobs, rendering=len(self.in_flight), cached=len(self.cache._entries),
+                        cache_mb=round(self.cache.current_bytes / 1024 / 1024, 1))
+
+def _int_param(params: dict, name: str, default: int, low: int, high: int) -> int:
+    try:
+        value = int(params.get(name, default))
+    except ValueError:
+        raise RequestError(HTTPStatus.BAD_REQUEST, f'{name} must be an integer')
+    if not low <= value <= high:
+        raise RequestError(HTTPStatus.BAD_REQUEST, f'{name} must be between {low} and {high}')
+    return value
+
+class PreviewHandler(BaseHTTPRequestHandler):
+    """GET /floor?tile=...  GET /wall?path=...&images=...  GET /wall?config=...&page=...  GET / (stats)"""
+
+    def do_GET(self):
+        service = self.server.service
+        url = urlsplit(self.path)
+        params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        try:
+            if url.path == '/':
+                return self._send_json(HTTPStatus.OK, service.stats())
+            if url.path not in ('/floor', '/wall'):
+                raise RequestError(HTTPStatus.NOT_FOUND, f'unknown endpoint {url.path}')
+
+            etag, fn, args = service.prepare(url.path[1:], params)
+            if etag in [tag.strip().removeprefix('W/') for tag in self.headers.get('If-None-Match', '').split(',')]:
+                with service._lock:
+                    service.counts['not_modified'] += 1
+                self.send_response(HTTPStatus.NOT_MODIFIED)
+                self.send_header('ETag', etag)
+                self.end_headers()
+                return
+
+            start = time.perf_counter()
+            data, how = service.get(etag, fn, args)
+            self.send_response(HTTPStatus.OK)
+            self.send_header('Content-Type', 'image/jpeg')
+            self.send_header('Content-Length', str(len(data)))
+            self.send_header('ETag', etag)
+            # Sources can change on disk, so clients revalidate (cheaply, with If-None-Match) every time
+            self.send_header('Cache-Control', 'no-cache')
+            self.send_header('X-Cache', how)
+            self.send_header('X-Render-Ms', f'{(time.perf_counter() - start) * 1000:.0f}')
+            self.end_headers()
+            self.wfile.write(data)
+        except RequestError as e:
+            self._send_json(e.status, {'error': str(e)})
+        except Exception as e:
+            with service._lock:
+                service.counts['error'] += 1
+            self._send_json(HTTPStatus.INTERNAL_SERVER_ERROR, {'error': str(e)})
+
+    def _send_json(self, status: HTTPStatus, body: dict):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve floor and wall previews over HTTP')
+    parser.add_argument('--host', default=DEFAULT_HOST, help=f'Address to listen on (default: {DEFAULT_HOST})')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help=f'Port to listen on (default: {DEFAULT_PORT})')
+    parser.add_argument('--root', default='.', help='Only images and configs under this directory are served (default: .)')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1, metavar='N',
+                        help='Render worker processes (default: all CPUs)')
+    parser.add_argument('--cache-mb', type=int, default=DEFAULT_PREVIEW_MB,
+                        help=f'Memory budget in MB for rendered previews (default: {DEFAULT_PREVIEW_MB})')
+    args = parser.parse_args()
+
+    service = RenderService(args.root, args.jobs, args.cache_mb * 1024 * 1024)
+    server = ThreadingHTTPServer((args.host, args.port), PreviewHandler)
+    server.daemon_threads = True
+    server.service = service
+    print(f"Serving previews on http://{args.host}:{args.port}/ with {service.jobs} workers; press Ctrl+C to stop")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("Stopping")
+    finally:
+        server.server_close()
+        service.close()
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,17 @@
+import io
 from PIL import Image
 from reportlab.pdfgen import canvas
+from reportlab.lib.utils import ImageReader
 from reportlab.lib.pagesizes import letter
 import os
 import math
 import argparse
 import time
+from concurrent.futures import ThreadPoolExecutor
+from pdf_images import PdfImageRegistry, binary_streams
+from profiler import profiler, add_profile_argument
+from derivative_cache import derivatives
+from image_loader import load_image, upright_size
 
 def parse_args():
     parser = argparse.ArgumentParser(description='Generate PDF product catalog from images')
@@ -24,127 +31,291 @@ def parse_args():
     parser.add_argument('--compress',
                         type=float,
                         default=None,
-                        help='Target maximum PDF file size in MB (best effort, e.g. 2 for 2MB)')
+                        help='Target maximum PDF file size in MB (e.g. 2 for 2MB); picks the best image quality that fits')
+    parser.add_argument('--jobs',
+                        type=int,
+                        default=os.cpu_count() or 1,
+                        help='Images encoded in parallel by --compress (default: all CPUs)')
+    add_profile_argument(parser)
     return parser.parse_args()
 
-# Paths and configuration
-args = parse_args()
-image_dir = args.input_image_path
-
-# Set output PDF path with timestamp if not provided
-if args.out:
-    output_pdf = f"out/{args.out}.pdf"
-    if not output_pdf.lower().endswith('.pdf'):
-        output_pdf += '.pdf'
-else:
-    timestamp = time.strftime("%Y%m%d_%H%M%S")
-    output_pdf = f"out/simple_catalog_{timestamp}.pdf"
-
-images_per_row = args.cols
-rows_per_page = args.rows
-images_per_page = images_per_row * rows_per_page
+# Page layout
 row_spacing = 40  # Space between rows
 page_width, page_height = letter
 margin = 50
 spacing = 10
+font_size = 10
 
 # Header configuration
 header_text = "Deltaware.in - Parking Tiles Catalog - Whatsapp: 9940198130"
 header_font_size = 14
 header_margin = 100
 
-# Create a PDF canvas
-c = canvas.Canvas(output_pdf, pagesize=letter)
+# --compress search space, best first. Every scale is tried from the top quality
+# down to MIN_QUALITY before the next (smaller) scale; only the smallest scale
+# goes below it, as fewer pixels look better than heavy JPEG artefacts.
+BUDGET_SCALES = (1.0, 0.8, 0.64, 0.5, 0.4, 0.32, 0.25, 0.16, 0.1)
+BUDGET_QUALITIES = (95, 90, 85, 80, 75, 70, 65, 60, 50, 40, 30, 20)
+MIN_QUALITY = 60
+# Pixels beyond this resolution at the placed size never show, even in print
+PRINT_DPI = 300
+# Rough size of everything in the PDF that is not image data
+PDF_PAGE_OVERHEAD = 2000
+PDF_IMAGE_OVERHEAD = 500
 
-# Get image files
-image_files = [f for f in os.listdir(image_dir) if f.lower().endswith((".jpg", ".jpeg", ".png"))]
-image_files.sort()
+def output_path(out_name: str | None) -> str:
+    """Return the output PDF path (timestamped when no name is given)"""
+    if out_name:
+        output_pdf = f"out/{out_name}.pdf"
+        if not output_pdf.lower().endswith('.pdf'):
+            output_pdf += '.pdf'
+    else:
+        timestamp = time.strftime("%Y%m%d_%H%M%S")
+        output_pdf = f"out/simple_catalog_{timestamp}.pdf"
+    return output_pdf
 
-# Image dimensions for placement
-usable_width = page_width - 2 * margin
-usable_height = page_height - header_margin - margin  # Adjust usable height to account for header and bottom margin
-image_width = (usable_width - (images_per_row - 1) * spacing) / images_per_row
-image_height = (usable_height - (rows_per_page - 1) * row_spacing) / rows_per_page
+def list_images(image_dir: str) -> list:
+    image_files = [f for f in os.listdir(image_dir) if f.lower().endswith((".jpg", ".jpeg", ".png"))]
+    image_files.sort()
+    return image_files
 
-font_size = 10
-temp_files = []  # Track temporary files for cleanup
+def cell_geometry(rows_per_page: int, images_per_row: int) -> tuple:
+    """Size in points of one image cell on the page"""
+    usable_width = page_width - 2 * margin
+    usable_height = page_height - header_margin - margin  # Adjust usable height to account for header and bottom margin
+    image_width = (usable_width - (images_per_row - 1) * spacing) / images_per_row
+    image_height = (usable_height - (rows_per_page - 1) * row_spacing) / rows_per_page
+    return image_width, image_height
+
+def encode_jpeg(img: Image.Image, quality: int) -> bytes:
+    buffer = io.BytesIO()
+    img.save(buffer, format='JPEG', quality=quality, optimize=True)
+    return buffer.getvalue()
+
+def prepare_image(img_path: str, cell_width: float, cell_height: float, quality: int):
+    """Encode an image as an in-memory JPEG and compute its size in the cell
+    Returns:
+        (ImageReader, draw_width, draw_height)
+    """
+    img = load_image(img_path)
+    # Calculate scaling factor to fit image inside the cell, preserving aspect ratio
+    iw, ih = img.size
+    scale = min(cell_width / iw, cell_height / ih, 1.0)
+
+    # Convert RGBA/palette images to RGB for JPEG encoding
+    if img.mode not in ('RGB', 'L'):
+        img = img.convert('RGB')
+
+    with profiler.stage('encode'):
+        data = encode_jpeg(img, quality)
+    return ImageReader(io.BytesIO(data)), iw * scale, ih * scale
 
-# Set image quality based on compress argument
-if args.compress:
-    image_quality = 25  # Lower quality for smaller file size
-else:
-    image_quality = 85  # Default quality
+def budget_levels() -> list:
+    """(scale, quality) settings in the order --compress tries them, best first"""
+    levels = []
+    for scale in BUDGET_SCALES:
+        for quality in BUDGET_QUALITIES:
+            if quality >= MIN_QUALITY or scale == BUDGET_SCALES[-1]:
+                levels.append((scale, quality))
+    return levels
 
-# Calculate total pages
-total_pages = math.ceil(len(image_files) / images_per_page)
+def _print_image(img_path: str, cell_width: float, cell_height: float):
+    """Open an image at no more than PRINT_DPI for its placed size
+    Returns:
+        (image, draw_width, draw_height)
+    """
+    iw, ih = upright_size(img_path)
+    fit = min(cell_width / iw, cell_height / ih, 1.0)
+    draw_w, draw_h = iw * fit, ih * fit
+    target = (max(1, round(draw_w / 72 * PRINT_DPI)), max(1, round(draw_h / 72 * PRINT_DPI)))
+    if target[0] < iw:
+        # Downscaled copies come from the derivative cache once they have been built
+        img = derivatives.get(img_path, 'fit', target)
+    else:
+        img = load_image(img_path)
+    if img.mode not in ('RGB', 'L'):
+        img = img.convert('RGB')
+    return img, draw_w, draw_h
 
-for page_num in range(total_pages):
-    start_idx = page_num * images_per_page
-    end_idx = start_idx + images_per_page
-    page_images = image_files[start_idx:end_idx]
+def _scaled(img: Image.Image, scale: float) -> Image.Image:
+    if scale == 1.0:
+        return img
+    size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+    return img.resize(size, Image.LANCZOS)
 
-    # Add header
-    c.setFont("Helvetica-Bold", header_font_size)
-    c.drawString(margin, page_height - margin, header_text)    
+def image_cost_table(img_path: str, cell_width: float, cell_height: float, levels: list) -> list:
+    """Encoded size in bytes of an image at every (scale, quality) level"""
+    with profiler.stage('cost_table', image=os.path.basename(img_path)):
+        img, _, _ = _print_image(img_path, cell_width, cell_height)
+        costs = []
+        resized = {}
+        for scale, quality in levels:
+            if scale not in resized:
+                resized = {scale: _scaled(img, scale)}
+            costs.append(len(encode_jpeg(resized[scale], quality)))
+    return costs
 
-    # Add page number
-    c.setFont("Helvetica", 8)
-    c.drawString(page_width/2, margin/2, f"Page {page_num + 1} of {total_pages}")
+def encode_at_level(img_path: str, cell_width: float, cell_height: float, level: tuple):
+    """Encode an image for the catalog at one (scale, quality) level
+    Returns:
+        (JPEG bytes, draw_width, draw_height)
+    """
+    scale, quality = level
+    img, draw_w, draw_h = _print_image(img_path, cell_width, cell_height)
+    with profiler.stage('encode'):
+        return encode_jpeg(_scaled(img, scale), quality), draw_w, draw_h
 
-    for j, image_file in enumerate(page_images):
+def solve_budget(image_dir: str, budget_bytes: int, rows_per_page: int, images_per_row: int,
+                 jobs: int = 1) -> list:
+    """Rank the (scale, quality) levels that fit the whole catalog into budget_bytes
+    Every image's exact encoded size is measured at every level (in parallel),
+    and the document total is the sum plus an estimate of the PDF overhead.
+    Returns:
+        [(level, estimated_bytes), ...] for every level, best quality first,
+        starting at the best level expected to fit (or the smallest level if
+        nothing does)
+    """
+    image_files = list_images(image_dir)
+    cell_width, cell_height = cell_geometry(rows_per_page, images_per_row)
+    levels = budget_levels()
+
+    def cost_table(image_file):
         try:
-            # Calculate position with increased row spacing
-            col = j % images_per_row
-            row = j // images_per_row
-            x = margin + col * (image_width + spacing)
-            y = page_height - header_margin - row * (image_height + row_spacing)
-
-            # Draw image
-            img_path = os.path.join(image_dir, image_file)
-            img = Image.open(img_path)
-
-            # Calculate scaling factor to fit image inside the cell, preserving aspect ratio
-            iw, ih = img.size
-            scale = min(image_width / iw, image_height / ih, 1.0)
-            draw_w = iw * scale
-            draw_h = ih * scale
-
-            # Center the image in the cell
-            draw_x = x + (image_width - draw_w) / 2
-            draw_y = y - image_height + (image_height - draw_h) / 2
-
-            # Convert RGBA to RGB if needed
-            if img.mode == 'RGBA':
-                img = img.convert('RGB')
-
-            temp_file = os.path.join(os.environ["TEMP"], f"resized_{start_idx + j}.jpg") if os.name == 'nt' else os.path.join("/tmp", f"resized_{start_idx + j}.jpg")
-            img.save(temp_file, quality=image_quality, optimize=True)
-            temp_files.append(temp_file)
-
-            c.drawImage(temp_file, draw_x, draw_y, draw_w, draw_h, preserveAspectRatio=True, anchor='c')
-
-            # Add product name
-            product_name = os.path.splitext(image_file)[0]
-            c.setFont("Helvetica-Bold", font_size)
-            label_width = c.stringWidth(product_name, "Helvetica-Bold", font_size)
-            label_x = x + (image_width - label_width) / 2
-            label_y = y - image_height - 15
-            c.drawString(label_x, label_y, product_name)
-            
+            return image_cost_table(os.path.join(image_dir, image_file), cell_width, cell_height, levels)
         except Exception as e:
+            # generate_catalog skips the image too, so it costs nothing
             print(f"Error processing image {image_file}: {str(e)}")
-            continue
+            return None
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        tables = [table for table in pool.map(cost_table, image_files) if table is not None]
+
+    # Failed images still take their cell, so the page count includes them
+    pages = math.ceil(len(image_files) / (rows_per_page * images_per_row))
+    overhead = pages * PDF_PAGE_OVERHEAD + len(tables) * PDF_IMAGE_OVERHEAD
+    totals = [overhead + sum(table[i] for table in tables) for i in range(len(levels))]
+    first = next((i for i, total in enumerate(totals) if total <= budget_bytes), len(levels) - 1)
+    return list(zip(levels, totals))[first:]
+
+@binary_streams()
+def generate_catalog(image_dir: str, output_pdf: str, rows_per_page: int = 3, images_per_row: int = 3,
+                     image_quality: int = 85, level: tuple | None = None, jobs: int = 1):
+    """Write the catalog PDF
+    Images are embedded at image_quality, or with a (scale, quality) level from
+    solve_budget, in which case they are encoded up front on jobs threads.
+    """
+    images_per_page = images_per_row * rows_per_page
+    os.makedirs(os.path.dirname(output_pdf), exist_ok=True)
+
+    # Create a PDF canvas
+    c = canvas.Canvas(output_pdf, pagesize=letter)
+    registry = PdfImageRegistry(c)
+
+    # Get image files
+    image_files = list_images(image_dir)
+
+    # Image dimensions for placement
+    image_width, image_height = cell_geometry(rows_per_page, images_per_row)
+
+    encoded = {}
+    if level is not None:
+        def encode(image_file):
+            try:
+                return encode_at_level(os.path.join(image_dir, image_file), image_width, image_height, level)
+            except Exception as e:
+                return e
+        with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+            encoded = dict(zip(image_files, pool.map(encode, image_files)))
+
+    # Calculate total pages
+    total_pages = math.ceil(len(image_files) / images_per_page)
+
+    for page_num in range(total_pages):
+        with profiler.stage('page', page=page_num + 1):
+            start_idx = page_num * images_per_page
+            end_idx = start_idx + images_per_page
+            page_images = image_files[start_idx:end_idx]
+
+            # Add header
+            c.setFont("Helvetica-Bold", header_font_size)
+            c.drawString(margin, page_height - margin, header_text)    
+
+            # Add page number
+            c.setFont("Helvetica", 8)
+            c.drawString(page_width/2, margin/2, f"Page {page_num + 1} of {total_pages}")
+
+            for j, image_file in enumerate(page_images):
+                try:
+                    # Calculate position with increased row spacing
+                    col = j % images_per_row
+                    row = j // images_per_row
+                    x = margin + col * (image_width + spacing)
+                    y = page_height - header_margin - row * (image_height + row_spacing)
+
+                    # Draw image straight from memory
+                    img_path = os.path.join(image_dir, image_file)
+                    if level is None:
+                        image, draw_w, draw_h = prepare_image(img_path, image_width, image_height, image_quality)
+                    else:
+                        result = encoded[image_file]
+                        if isinstance(result, Exception):
+                            raise result
+                        data, draw_w, draw_h = result
+                        image = ImageReader(io.BytesIO(data))
+
+                    # Center the image in the cell
+                    draw_x = x + (image_width - draw_w) / 2
+                    draw_y = y - image_height + (image_height - draw_h) / 2
+
+                    registry.draw(image, draw_x, draw_y, draw_w, draw_h, preserve_aspect=True)
+
+                    # Add product name
+                    product_name = os.path.splitext(image_file)[0]
+                    c.setFont("Helvetica-Bold", font_size)
+                    label_width = c.stringWidth(product_name, "Helvetica-Bold", font_size)
+                    label_x = x + (image_width - label_width) / 2
+                    label_y = y - image_height - 15
+                    c.drawString(label_x, label_y, product_name)
+                
+                except Exception as e:
+                    print(f"Error processing image {image_file}: {str(e)}")
+                    continue
+
+            c.showPage()
+
+    # Save the PDF (only once)
+    with profiler.stage('pdf.save'):
+        c.save()
+    print(registry.summary())
+
+def main():
+    args = parse_args()
+    if args.profile is not None:
+        profiler.enable()
+    output_pdf = output_path(args.out)
 
-    c.showPage()
+    if not args.compress:
+        generate_catalog(args.input_image_path, output_pdf, args.rows, args.cols)
+        print(f"Product catalog created: {output_pdf}")
+        profiler.report(args.profile, 'simple_catalog')
+        return
 
-# Save the PDF (only once)
-c.save()
+    budget = int(args.compress * 1024 * 1024)
+    with profiler.stage('solve'):
+        candidates = solve_budget(args.input_image_path, budget, args.rows, args.cols, args.jobs)
+    # The overhead is only estimated, so step down a level if the PDF still comes out too big
+    for attempt, (level, estimate) in enumerate(candidates):
+        generate_catalog(args.input_image_path, output_pdf, args.rows, args.cols, level=level, jobs=args.jobs)
+        size = os.path.getsize(output_pdf)
+        if size <= budget or attempt == len(candidates) - 1:
+            break
 
-# Cleanup temporary files
-for temp_file in temp_files:
-    try:
-        os.remove(temp_file)
-    except:
-        pass
+    scale, quality = level
+    print(f"Product catalog created: {output_pdf}")
+    print(f"Size: {size / 1024 / 1024:.2f} MB of {args.compress:g} MB target "
+          f"(JPEG quality {quality}, {scale:.0%} of print resolution)")
+    if size > budget:
+        print("Warning: the target is below the smallest size this catalog can be compressed to")
+    profiler.report(args.profile, 'simple_catalog')
 
-print(f"Product catalog created: {output_pdf}")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -9,9 +9,34 @@ import cv2
 import argparse
 import os
 import json
+import zipfile
+import time
+import threading
+import dataclasses
+from concurrent.futures import ThreadPoolExecutor
+from build_cache import BuildManifest
+from pdf_images import PdfImageRegistry
+from profiler import profiler, add_profile_argument
+from derivative_cache import derivatives
+from output_encoder import EncoderSettings, save_image, add_encoder_arguments, encoder_from_args
 
 IMAGE_OUTPUT_PATH = './out/visual/'
 
+# Bump whenever a change alters the rendered pixels so cached pages are rebuilt
+FLOOR_RENDERER_VERSION = 5
+DEPTH_FACTOR = 2.5
+FLOOR_ENGINES = ('grid', 'direct')
+# Tiles are resized to this square before laying out the floor
+FLOOR_TILE_SIZE = 200
+# Bounding box of the tile thumbnail drawn on every page
+THUMB_SIZE = (400, 400)
+# Settings of one entry in a JSON page's "outputs" list, and their defaults
+FLOOR_OUTPUT_DEFAULTS = {'depth': DEPTH_FACTOR, 'width': None, 'format': 'jpg', 'quality': None, 'thumbnail': True,
+                         'suffix': None}
+FLOOR_OUTPUT_FORMATS = {'jpg': 'JPEG', 'jpeg': 'JPEG', 'png': 'PNG', 'webp': 'WEBP'}
+# JPEG and WebP pages are written at Pillow's default quality unless --min-ssim or an output's "quality" says otherwise
+FLOOR_ENCODER = EncoderSettings()
+
 def parse_args():
     parser = argparse.ArgumentParser(description='Generate floor tile visualization')
     # Add all arguments first
@@ -24,16 +49,146 @@ def parse_args():
     parser.add_argument('--in_file', type=str, help='Input tile image path')
     parser.add_argument('--out_file', type=str, help='Output file path (optional)')
     parser.add_argument('--pdf', action='store_true', help='Generate PDF output')
+    parser.add_argument('--engine', choices=FLOOR_ENGINES, default=None,
+                        help='grid: build the flat floor then warp it (default); '
+                             'direct: sample the perspective view straight from the tile')
+    parser.add_argument('--force', action='store_true', help='Re-render every page even if its output is up to date')
+    parser.add_argument('--jobs', type=int, default=1, metavar='N', help='Render N JSON pages concurrently (default: 1)')
+    add_encoder_arguments(parser)
+    add_profile_argument(parser)
     
     # Parse arguments
     return parser.parse_args()
 
-def apply_perspective(in_file: str, image: Image.Image, depth_factor: float = 2.0, saveFile: bool = False) -> Image.Image:
+# Border added around the floor before warping, and the margins cropped from the warped result
+PERSPECTIVE_PAD = 10
+PERSPECTIVE_CROP = (1100, 2200, 1100, 800)  # left, top, right, bottom
+
+def perspective_transform(width: int, height: int, depth_factor: float):
+    """Compute the perspective warp for a floor, with the final crop folded in
+    Args:
+        width: Floor width in pixels (without padding)
+        height: Floor height in pixels (without padding)
+        depth_factor: Controls perspective intensity (1.0-3.0)
+    Returns:
+        (matrix, (out_width, out_height)) mapping the padded floor straight to the
+        cropped output window, or None if the crop does not fit the floor
+    """
+    pad = PERSPECTIVE_PAD
+    left_crop, top_crop, right_crop, bottom_crop = PERSPECTIVE_CROP
+
+    # Validate crop values
+    if left_crop + right_crop >= width or top_crop + bottom_crop >= height:
+        return None
+
+    # Dimensions of the padded floor
+    width, height = width + 2 * pad, height + 2 * pad
+
+    # Calculate offsets based on depth_factor
+    inset = width * 0.15 * depth_factor   # Horizontal inset
+    drop = height * 0.15 * depth_factor   # Vertical drop
+
+    # Source points (original corners with padding)
+    src_points = np.float32([
+        [pad, pad],               # top-left
+        [width-pad, pad],         # top-right
+        [pad, height-pad],        # bottom-left
+        [width-pad, height-pad]   # bottom-right
+    ])
+
+    # Destination points (transformed corners)
+    dst_points = np.float32([
+        [pad + inset, pad + drop],        # top-left moved down and right
+        [width - pad - inset, pad + drop], # top-right moved down and left
+        [pad, height-pad],                 # bottom-left unchanged
+        [width-pad, height-pad]            # bottom-right unchanged
+    ])
+    matrix = cv2.getPerspectiveTransform(src_points, dst_points)
+
+    # Shift the output so its origin is the top-left corner of the kept window
+    # (padding removal plus crop), so only visible pixels are ever computed
+    shift = np.array([
+        [1, 0, -(pad + left_crop)],
+        [0, 1, -(pad + top_crop)],
+        [0, 0, 1]
+    ], dtype=np.float64)
+    out_size = (width - 2 * pad - left_crop - right_crop,
+                height - 2 * pad - top_crop - bottom_crop)
+    return shift @ matrix, out_size
+
+# Persisted remap tables, keyed by floor size, padding and depth factor
+REMAP_CACHE_PATH = './out/cache/remap/'
+REMAP_TABLE_VERSION = 2
+_remap_tables = {}
+_remap_tables_lock = threading.Lock()
+
+def perspective_remap_tables(width: int, height: int, depth_factor: float, cache_dir: str | None = REMAP_CACHE_PATH):
+    """Return cv2.remap tables for the perspective warp of a floor of this size
+    Tables are built once per (floor size, padding, depth factor), kept for the
+    rest of the run and saved under cache_dir so later runs only load them.
+    Args:
+        width: Floor width in pixels (without padding)
+        height: Floor height in pixels (without padding)
+        depth_factor: Controls perspective intensity (1.0-3.0)
+        cache_dir: Directory for persisted tables (None keeps them in memory only)
+    Returns:
+        (map_x, map_y) float32 tables for cv2.remap over the padded floor, or
+        None if the crop does not fit or the output is too large for cv2.remap
+    """
+    key = (width, height, PERSPECTIVE_PAD, round(depth_factor, 4))
+    # Pages rendered on worker threads wait for the first build instead of repeating it
+    with _remap_tables_lock:
+        if key not in _remap_tables:
+            _remap_tables[key] = _load_remap_tables(key, depth_factor, cache_dir)
+        return _remap_tables[key]
+
+def _load_remap_tables(key: tuple, depth_factor: float, cache_dir: str | None):
+    """Load persisted remap tables for key, or build and persist them"""
+    width, height = key[0], key[1]
+    transform = perspective_transform(width, height, depth_factor)
+    if transform is None or max(transform[1]) >= 32767:
+        return None
+
+    cache_file = None
+    if cache_dir:
+        cache_file = os.path.join(cache_dir, f'remap_v{REMAP_TABLE_VERSION}_{width}x{height}_p{key[2]}_d{key[3]}.npz')
+        try:
+            with np.load(cache_file) as data:
+                return data['map_x'], data['map_y']
+        except (OSError, KeyError, ValueError, EOFError, zipfile.BadZipFile):
+            pass  # Missing or damaged: rebuild and persist again below
+
+    # Inverse homography: output pixel -> padded floor coordinate, in float32 with
+    # the per-row terms grouped first. This is close to warpPerspective's own
+    # coordinate math, but not identical: measured on a 20x20 floor at depth 1.5
+    # to 3.0, about 0.1% of pixels differ from warpPerspective, by one level.
+    # (5-bit fixed-point tables differed on about 23% of pixels, by up to 4 levels.)
+    matrix, (out_width, out_height) = transform
+    inverse = cv2.invert(matrix)[1].astype(np.float32)
+    grid_x, grid_y = np.meshgrid(np.arange(out_width, dtype=np.float32), np.arange(out_height, dtype=np.float32))
+    w = inverse[2, 0] * grid_x + (inverse[2, 1] * grid_y + inverse[2, 2])
+    map_x = (inverse[0, 0] * grid_x + (inverse[0, 1] * grid_y + inverse[0, 2])) / w
+    map_y = (inverse[1, 0] * grid_x + (inverse[1, 1] * grid_y + inverse[1, 2])) / w
+    tables = (map_x, map_y)
+
+    if cache_file:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_file = f'{cache_file}.{os.getpid()}.tmp.npz'
+        np.savez(tmp_file, map_x=tables[0], map_y=tables[1])
+        os.replace(tmp_file, cache_file)
+
+    return tables
+
+def apply_perspective(in_file: str, image: Image.Image | np.ndarray, depth_factor: float = 2.0, saveFile: bool = False,
+                      use_remap_cache: bool = False) -> Image.Image:
     """Apply perspective transform to make floor appear 3D and save result
+    Only the cropped output window is warped; the crop is part of the transform.
     Args:
         in_file: Input filename for save path
-        image: PIL Image to transform
+        image: PIL Image (or RGB array) to transform
         depth_factor: Controls perspective intensity (1.0-3.0)
+        use_remap_cache: Warp with cached remap tables (see perspective_remap_tables)
+            instead of computing the transform again for this image
     Returns:
         Transformed PIL Image
     """
@@ -42,71 +197,28 @@ def apply_perspective(in_file: str, image: Image.Image, depth_factor: float = 2.
         depth_factor = max(1.0, min(3.0, depth_factor))
                 
         # Convert PIL to OpenCV format
-        img_cv = np.array(image)
+        img_cv = np.asarray(image)
+        height, width = img_cv.shape[:2]
+
+        transform = perspective_transform(width, height, depth_factor)
+        if transform is None:
+            print(f"Error: Crop values exceed image dimensions for file {in_file}. Skipping file.")
+            return image if isinstance(image, Image.Image) else Image.fromarray(image)
+        matrix, out_size = transform
         
         # Add padding to prevent cropping
-        pad = 10
+        pad = PERSPECTIVE_PAD
         img_padded = cv2.copyMakeBorder(img_cv, pad, pad, pad, pad, 
                                        cv2.BORDER_CONSTANT, value=[255, 255, 255])
         
-        # Get dimensions
-        height, width = img_padded.shape[:2]
-        
-        # Calculate offsets based on depth_factor
-        inset = width * 0.15 * depth_factor   # Horizontal inset
-        drop = height * 0.15 * depth_factor   # Vertical drop
-        
-        # Source points (original corners with padding)
-        src_points = np.float32([
-            [pad, pad],               # top-left
-            [width-pad, pad],         # top-right
-            [pad, height-pad],        # bottom-left
-            [width-pad, height-pad]   # bottom-right
-        ])
-        
-        # Destination points (transformed corners)
-        dst_points = np.float32([
-            [pad + inset, pad + drop],        # top-left moved down and right
-            [width - pad - inset, pad + drop], # top-right moved down and left
-            [pad, height-pad],                 # bottom-left unchanged
-            [width-pad, height-pad]            # bottom-right unchanged
-        ])
-        
-        # Calculate and apply transform
-        matrix = cv2.getPerspectiveTransform(src_points, dst_points)
-        img_transformed = cv2.warpPerspective(img_padded, matrix, (width, height))
-        
-        # Convert back to PIL and crop padding
+        # Warp straight into the cropped output window
+        tables = perspective_remap_tables(width, height, depth_factor) if use_remap_cache else None
+        with profiler.stage('warp'):
+            if tables is not None:
+                img_transformed = cv2.remap(img_padded, tables[0], tables[1], cv2.INTER_LINEAR)
+            else:
+                img_transformed = cv2.warpPerspective(img_padded, matrix, out_size)
         result = Image.fromarray(img_transformed)
-        result = result.crop((pad, pad, width-pad, height-pad))
-
-        # Get dimensions after padding removal
-        width, height = result.size
-
-        # Calculate crop dimensions
-        left_crop = 1100
-        right_crop = 1100
-        top_crop = 2200
-        bottom_crop = 800
-
-        # Validate crop values
-        if left_crop + right_crop >= width or top_crop + bottom_crop >= height:
-            print(f"Error: Crop values exceed image dimensions for file {in_file}. Skipping file.")
-            return image
-        
-        # Print Image Size
-        #print(f"Image size - Width: {width}, Height: {height}")
-        # Print crop values
-        #print(f"Crop values - Left: {left_crop}, Right: {right_crop}, Top: {top_crop}, Bottom: {bottom_crop}")
-
-        # Apply all crops in one operation
-        result = result.crop((
-            left_crop,           # left
-            top_crop,            # top
-            width - right_crop,  # right
-            height - bottom_crop # bottom
-        ))
-
                 
         # Save if filename provided
         if saveFile:
@@ -134,29 +246,54 @@ def get_rotation(row: int, col: int) -> int:
     ]
     return rotation_matrix[row % 2][col % 2]
 
-def generate_floor(rows: int, cols: int, in_file: str, rotate: bool = False, padding: int = 0, saveFile: bool = False) -> Image.Image:
+def compose_floor(tile: Image.Image, rows: int, cols: int, rotate: bool = False, padding: int = 0) -> np.ndarray:
+    """Lay out a square tile in a rows x cols grid with grout between tiles
+    The 2x2 rotation block (see get_rotation) is built once and then repeated
+    with array tiling into a single preallocated buffer. Tiles that overflow the
+    floor because of padding are clipped, matching a paste-per-cell layout.
+    Args:
+        tile: Square tile image
+        rows: Number of tile rows
+        cols: Number of tile columns
+        rotate: Rotate alternate tiles in the 2x2 pattern
+        padding: Grout width in pixels between tiles
+    Returns:
+        RGB array of shape (rows * tile_size, cols * tile_size, 3)
+    """
+    tile_arr = np.asarray(tile.convert('RGB'))
+    tile_size = tile_arr.shape[0]
+    unit = tile_size + padding
+    width, height = cols * tile_size, rows * tile_size
+
+    # 2x2 block of tiles, each followed by its grout (white)
+    block = np.full((2 * unit, 2 * unit, 3), 255, dtype=np.uint8)
+    for row in range(2):
+        for col in range(2):
+            # np.rot90 turns counter-clockwise, like PIL's rotate()
+            quarter_turns = get_rotation(row, col) // 90 if rotate else 0
+            block[row * unit:row * unit + tile_size,
+                  col * unit:col * unit + tile_size] = np.rot90(tile_arr, quarter_turns)
+
+    # One band of two tile rows spanning the full width, then copy it down the floor
+    band = np.tile(block, (1, -(-width // (2 * unit)), 1))[:, :width]
+    floor = np.empty((height, width, 3), dtype=np.uint8)
+    for y in range(0, height, 2 * unit):
+        band_height = min(2 * unit, height - y)
+        floor[y:y + band_height] = band[:band_height]
+
+    return floor
+
+def generate_floor(rows: int, cols: int, in_file: str, rotate: bool = False, padding: int = 0, saveFile: bool = False,
+                   tile: Image.Image | None = None) -> Image.Image:
+    """Build the flat top-down floor for a tile
+    Turning the composed array into a PIL Image costs about as much as composing
+    it, so the perspective pipeline warps _floor_array() directly instead.
+    Args:
+        tile: Tile already loaded with load_tile (loaded from in_file if None)
+    """
     
     try:
-        # Load and resize tile image
-        tile = Image.open(in_file)
-        tile_size = 200  # pixels
-        tile = tile.resize((tile_size, tile_size))
-        
-        # Create floor image without padding in dimensions
-        floor = Image.new('RGB', (cols * tile_size, rows * tile_size), color='white')
-        
-        # Place tiles with rotation pattern and padding
-        for row in range(rows):
-            for col in range(cols):
-                current_tile = tile.copy()
-                if rotate:
-                    angle = get_rotation(row, col)
-                    current_tile = current_tile.rotate(angle)
-                    
-                # Calculate position - only add padding between tiles
-                x = col * tile_size + (padding * col if col > 0 else 0)
-                y = row * tile_size + (padding * row if row > 0 else 0)
-                floor.paste(current_tile, (x, y))
+        floor = Image.fromarray(_floor_array(rows, cols, in_file, rotate, padding, tile))
         
         # Save result
         if saveFile:
@@ -169,25 +306,132 @@ def generate_floor(rows: int, cols: int, in_file: str, rotate: bool = False, pad
         print(f"Error: {str(e)}")
         exit(1)
 
-def append_thumbnail(title: str, in_file: str, image: Image.Image, saveFile: bool = True) -> Image.Image:
+def _floor_array(rows: int, cols: int, in_file: str, rotate: bool = False, padding: int = 0,
+                 tile: Image.Image | None = None) -> np.ndarray:
+    """The flat floor as an RGB array, for apply_perspective"""
+    # Load and resize tile image
+    if tile is None:
+        tile = load_tile(in_file)
+    
+    # Place tiles with rotation pattern and padding
+    with profiler.stage('compose'):
+        return compose_floor(tile, rows, cols, rotate, padding)
+
+def load_tile(in_file: str, tile_size: int = FLOOR_TILE_SIZE) -> Image.Image:
+    """Load a tile image resized to the square size used on the floor (from the derivative cache)"""
+    with profiler.stage('decode'):
+        return derivatives.get(in_file, 'resize', (tile_size, tile_size))
+
+def render_floor_perspective(rows: int, cols: int, in_file: str, rotate: bool = False, padding: int = 0,
+                             depth_factor: float = 2.0, band_height: int = 256,
+                             tile: Image.Image | None = None) -> Image.Image:
+    """Render the perspective floor directly from the tile, without a flat floor image
+    Every output pixel is mapped back through the inverse homography to a floor
+    coordinate, then to a tile cell, its rotation and the position inside the tile
+    (or the grout between tiles), and sampled from a small atlas holding the four
+    rotations of the tile. Memory is proportional to the output, not the grid.
+    Args:
+        rows: Number of tile rows
+        cols: Number of tile columns
+        in_file: Input tile image path
+        rotate: Rotate alternate tiles in pattern
+        padding: Grout width in pixels between tiles
+        depth_factor: Controls perspective intensity (1.0-3.0)
+        band_height: Output rows mapped per pass
+        tile: Tile already loaded with load_tile (loaded from in_file if None)
+    Returns:
+        Perspective PIL Image, same framing as apply_perspective(generate_floor(...))
+    """
+    depth_factor = max(1.0, min(3.0, depth_factor))
+    if tile is None:
+        tile = load_tile(in_file)
+    tile_size = tile.size[0]
+    unit = tile_size + padding
+    width, height = cols * tile_size, rows * tile_size
+
+    transform = perspective_transform(width, height, depth_factor)
+    if transform is None:
+        print(f"Error: Crop values exceed image dimensions for file {in_file}. Skipping file.")
+        return generate_floor(rows, cols, in_file, rotate, padding, tile=tile)
+    matrix, (out_width, out_height) = transform
+    inverse = np.linalg.inv(matrix)
+
+    # Atlas slots: the tile at its four 2x2-pattern rotations, then white (grout and
+    # the padding ring) and black (outside the padded floor). Each slot carries a
+    # one pixel replicated border so bilinear sampling never bleeds between slots.
+    tile_arr = np.asarray(tile.convert('RGB'))
+    slot = tile_size + 2
+    atlas = np.empty((slot, 6 * slot, 3), dtype=np.uint8)
+    for index in range(4):
+        quarter_turns = get_rotation(index // 2, index % 2) // 90 if rotate else 0
+        atlas[:, index * slot:(index + 1) * slot] = cv2.copyMakeBorder(
+            np.ascontiguousarray(np.rot90(tile_arr, quarter_turns)), 1, 1, 1, 1, cv2.BORDER_REPLICATE)
+    atlas[:, 4 * slot:5 * slot] = 255
+    atlas[:, 5 * slot:] = 0
+    white_x, black_x, flat_y = 4.5 * slot, 5.5 * slot, slot / 2
+
+    # The keystone transform keeps output rows horizontal on the floor (no x term in
+    # the inverse's y and w rows), so everything vertical is computed once per row
+    pad = PERSPECTIVE_PAD
+    xs = np.arange(out_width, dtype=np.float32)
+    ys = np.arange(out_height, dtype=np.float64)
+    w = inverse[2, 1] * ys + inverse[2, 2]
+    fy = (inverse[1, 1] * ys + inverse[1, 2]) / w - pad
+    x_scale = (inverse[0, 0] / w).astype(np.float32)
+    x_offset = ((inverse[0, 1] * ys + inverse[0, 2]) / w - pad).astype(np.float32)
+
+    row = np.floor(fy / unit)
+    local_y = (fy - row * unit).astype(np.float32)
+    row_slot = ((row % 2) * 2).astype(np.float32)
+    row_on_tile = (fy >= 0) & (fy < height) & (local_y < tile_size)
+    row_in_ring = (fy >= -pad) & (fy < height + pad)
+
+    result = np.empty((out_height, out_width, 3), dtype=np.uint8)
+    # cv2.remap is limited to SHRT_MAX pixels per side, so map in blocks
+    block_width = 8192
+    for y0 in range(0, out_height, band_height):
+        y1 = min(y0 + band_height, out_height)
+        for x0 in range(0, out_width, block_width):
+            x1 = min(x0 + block_width, out_width)
+
+            # Output pixel -> floor x coordinate -> tile column and position inside it
+            fx = xs[None, x0:x1] * x_scale[y0:y1, None] + x_offset[y0:y1, None]
+            col = np.floor(fx / unit)
+            local_x = fx - col * unit
+            map_x = (col % 2 + row_slot[y0:y1, None]) * slot + 1 + local_x
+
+            on_tile = (fx >= 0) & (fx < width) & (local_x < tile_size) & row_on_tile[y0:y1, None]
+            in_ring = (fx >= -pad) & (fx < width + pad) & row_in_ring[y0:y1, None]
+            map_x[~on_tile] = white_x
+            map_x[~in_ring] = black_x
+            map_y = np.where(on_tile, 1 + local_y[y0:y1, None], np.float32(flat_y))
+
+            result[y0:y1, x0:x1] = cv2.remap(atlas, map_x, map_y.astype(np.float32),
+                                             cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+
+    return Image.fromarray(result)
+
+def append_thumbnail(title: str, in_file: str, image: Image.Image, saveFile: bool = True,
+                     thumb: Image.Image | None = None) -> Image.Image:
     """Add thumbnail and title in white margin at bottom left of image
     Args:
         title: Text to display below thumbnail
         in_file: Path to thumbnail image
         image: Main image to append to
         saveFile: Whether to save result
+        thumb: Thumbnail already made from in_file (loaded from the derivative cache if None)
     Returns:
         Modified image with thumbnail
     """
     try:
         # Constants
-        THUMB_SIZE = (400, 400)
         PADDING = 20
         FONT_SIZE = 30  # Increased font size
         
         # Create thumbnail with margin
-        thumb = Image.open(in_file)
-        thumb.thumbnail(THUMB_SIZE)
+        if thumb is None:
+            with profiler.stage('thumbnail'):
+                thumb = derivatives.get(in_file, 'thumbnail', THUMB_SIZE)
         
         # Create thumbnail background with margin
         thumb_bg = Image.new('RGB', 
@@ -200,10 +444,11 @@ def append_thumbnail(title: str, in_file: str, image: Image.Image, saveFile: boo
         
         # Add title text with larger font
         draw = ImageDraw.Draw(thumb_bg)
-        try:
-            font = ImageFont.truetype("arial.ttf", FONT_SIZE)
-        except:
-            font = ImageFont.load_default()
+        with profiler.stage('font'):
+            try:
+                font = ImageFont.truetype("arial.ttf", FONT_SIZE)
+            except:
+                font = ImageFont.load_default()
         
         # Position text below thumbnail
         text_y = THUMB_SIZE[1] + PADDING + 5
@@ -220,7 +465,8 @@ def append_thumbnail(title: str, in_file: str, image: Image.Image, saveFile: boo
         # Save if requested
         if saveFile:
             out_file = f'{IMAGE_OUTPUT_PATH}{os.path.splitext(os.path.basename(in_file))[0]}.jpg'
-            final.save(out_file)
+            with profiler.stage('encode'):
+                final.save(out_file)
             print(f"Saved with thumbnail: {out_file}")
             
         return final
@@ -251,6 +497,7 @@ def make_pdf(files_list: list, pdf_path: str, title: str):
         # Create PDF
         os.makedirs(os.path.dirname(pdf_path), exist_ok=True)
         c = canvas.Canvas(pdf_path, pagesize=A4)
+        registry = PdfImageRegistry(c)
         
         # Process images
         for i in range(0, len(files_list), IMAGES_PER_PAGE):
@@ -268,12 +515,12 @@ def make_pdf(files_list: list, pdf_path: str, title: str):
                 if i + j < len(files_list):
                     img_path = files_list[i + j]
                     y_pos = PAGE_HEIGHT - MARGIN - HEADER_OFFSET - (image_height + IMAGE_MARGIN) * j
-                    c.drawImage(img_path, 
-                              MARGIN, 
-                              y_pos - image_height,
-                              width=image_width,
-                              height=image_height,
-                              preserveAspectRatio=True)
+                    registry.draw(img_path, 
+                                  MARGIN, 
+                                  y_pos - image_height,
+                                  image_width,
+                                  image_height,
+                                  preserve_aspect=True)
             
             # Add centered page number at bottom
             page_num = f"Page {(i // IMAGES_PER_PAGE) + 1} of {total_pages}"
@@ -284,7 +531,9 @@ def make_pdf(files_list: list, pdf_path: str, title: str):
             
             c.showPage()
         
-        c.save()
+        with profiler.stage('pdf.save'):
+            c.save()
+        print(registry.summary())
         print(f"PDF Created: {pdf_path}")
         
     except Exception as e:
@@ -293,10 +542,151 @@ def make_pdf(files_list: list, pdf_path: str, title: str):
 
 #####
 
-def json_process(json_path: str, savePDF: bool = False) -> list:
+def render_page_floor(rows: int, cols: int, in_file: str, rotate: bool, padding: int,
+                      depth_factor: float = DEPTH_FACTOR, engine: str = 'grid') -> Image.Image:
+    """Render the perspective floor for one tile with the selected engine"""
+    if engine == 'direct':
+        with profiler.stage('warp'):
+            return render_floor_perspective(rows, cols, in_file, rotate, padding, depth_factor)
+    floor = _floor_array(rows, cols, in_file, rotate, padding)
+    return apply_perspective(in_file, floor, depth_factor, use_remap_cache=True)
+
+def floor_page_variants(page: dict) -> list:
+    """The images a JSON page is rendered to, with defaults filled in and their output paths
+    A page renders one JPEG unless it has an "outputs" list. Each entry there may
+    set depth (perspective depth factor), width (pixels, keeps the aspect ratio),
+    format (jpg, png, webp), quality, min_ssim (see output_encoder), thumbnail
+    (draw the tile thumbnail and title) and suffix (added to the file name; by
+    default made from every setting that differs from the default image, so
+    only outputs that would be identical collide). The first entry goes in the
+    PDF.
+    Returns:
+        One dict of settings per output, with 'path' added
+    """
+    base = os.path.splitext(os.path.basename(page['file']))[0]
+    variants = []
+    for spec in page.get('outputs') or [{}]:
+        variant = dict(FLOOR_OUTPUT_DEFAULTS, **spec)
+        fmt = str(variant['format']).lower()
+        if fmt not in FLOOR_OUTPUT_FORMATS:
+            raise ValueError(f"Unknown output format {variant['format']!r} for {page['file']} "
+                             f"(use one of {', '.join(FLOOR_OUTPUT_FORMATS)})")
+        suffix = variant['suffix']
+        if suffix is None:
+            suffix = ''
+            if variant['depth'] != DEPTH_FACTOR:
+                suffix += f"-d{variant['depth']:g}"
+            if variant['width']:
+                suffix += f"-{variant['width']}w"
+            if variant['quality'] is not None:
+                suffix += f"-q{variant['quality']}"
+            if variant.get('min_ssim') is not None:
+                suffix += f"-ssim{variant['min_ssim']:g}"
+            if not variant['thumbnail']:
+                suffix += '-plain'
+        variant['path'] = f"{IMAGE_OUTPUT_PATH}{base}{suffix}.{'jpg' if fmt == 'jpeg' else fmt}"
+        variants.append(variant)
+
+    paths = [variant['path'] for variant in variants]
+    if len(set(paths)) != len(paths):
+        raise ValueError(f"Outputs of {page['file']} need distinct suffixes: {', '.join(paths)}")
+    return variants
+
+def floor_page_outputs(page: dict) -> list:
+    """Paths of every image rendered for a JSON page, the one used in the PDF first"""
+    return [variant['path'] for variant in floor_page_variants(page)]
+
+def floor_page_output(page: dict) -> str:
+    """Path of the rendered image for a JSON page that goes in the PDF (named after its tile file)"""
+    return floor_page_outputs(page)[0]
+
+def save_floor_variant(image: Image.Image, variant: dict, encoder: EncoderSettings = FLOOR_ENCODER):
+    """Resize and encode one output of a page as its variant settings ask
+    JPEG and WebP outputs go through encoder, with the variant's own quality and
+    min_ssim taking precedence; PNG is written as is.
+    """
+    if variant['width'] and variant['width'] != image.width:
+        with profiler.stage('resize'):
+            width = int(variant['width'])
+            image = image.resize((width, max(1, round(image.height * width / image.width))), Image.LANCZOS)
+    image_format = FLOOR_OUTPUT_FORMATS[str(variant['format']).lower()]
+    if image_format == 'PNG':
+        with profiler.stage('encode'):
+            image.save(variant['path'], format=image_format)
+        print(f"Saved {variant['path']}")
+        return
+
+    encoder = dataclasses.replace(encoder, format=image_format.lower(),
+                                  quality=variant['quality'] or encoder.quality,
+                                  min_ssim=variant.get('min_ssim', encoder.min_ssim))
+    encoded = save_image(image, variant['path'], encoder)
+    print(f"Saved {variant['path']}")
+    if encoder.min_ssim is not None:
+        print(f"  {encoded.report(os.path.basename(variant['path']))}")
+
+def floor_page_config(page: dict, rows: int, cols: int, engine: str, encoder: EncoderSettings = FLOOR_ENCODER) -> dict:
+    """Everything besides the tile image that affects a rendered page (used for build hashes)"""
+    config = dict(page, rows=rows, cols=cols, depth_factor=DEPTH_FACTOR, engine=engine)
+    if encoder != FLOOR_ENCODER:
+        config['encoder'] = encoder.key()
+    return config
+
+def process_page(page: dict, rows: int, cols: int, engine: str = 'grid', encoder: EncoderSettings = FLOOR_ENCODER) -> str:
+    """Render one JSON page (floor, perspective, thumbnail) and save every output it declares
+    The tile is decoded and the flat floor composed once per page; each output
+    then costs only its own warp (one per depth factor), thumbnail, resize and
+    encode (see floor_page_variants).
+    Returns:
+        Path of the first output (the one used for the PDF)
+    """
+    in_file = page['file']
+    variants = floor_page_variants(page)
+
+    with profiler.stage('page', page=page['title']):
+        # Build the tile and the thumbnail from one decode of the source
+        with profiler.stage('decode'):
+            tile, thumb = derivatives.get_many(in_file, [('resize', (FLOOR_TILE_SIZE, FLOOR_TILE_SIZE)),
+                                                         ('thumbnail', THUMB_SIZE)])
+
+        # Generate the flat floor pattern once for every depth
+        floor = None
+        if engine != 'direct':
+            floor = _floor_array(rows, cols, in_file, page['rotate'], page['padding'], tile=tile)
+
+        warped = {}  # depth -> floor in perspective
+        views = {}   # (depth, thumbnail) -> finished image before resizing
+        for variant in variants:
+            depth = variant['depth']
+            if depth not in warped:
+                if engine == 'direct':
+                    with profiler.stage('warp'):
+                        warped[depth] = render_floor_perspective(rows, cols, in_file, page['rotate'], page['padding'], depth,
+                                                                 tile=tile)
+                else:
+                    warped[depth] = apply_perspective(in_file, floor, depth, use_remap_cache=True)
+            view_key = (depth, bool(variant['thumbnail']))
+            if view_key not in views:
+                # Append thumbnail with title
+                views[view_key] = (append_thumbnail(page['title'], in_file, warped[depth], saveFile=False, thumb=thumb)
+                                   if variant['thumbnail'] else warped[depth])
+            save_floor_variant(views[view_key], variant, encoder)
+    return variants[0]['path']
+
+def json_process(json_path: str, savePDF: bool = False, force: bool = False, engine: str | None = None,
+                 jobs: int = 1, encoder: EncoderSettings = FLOOR_ENCODER) -> list:
     """Load JSON config and generate floor visualization
+    Pages whose config, tile image and renderer version are unchanged since the
+    last run reuse their existing output unless force is set. With jobs > 1 pages
+    are rendered by a thread pool (OpenCV and Pillow release the GIL for the heavy
+    work); at most 2 * jobs pages are in flight and the returned list keeps the
+    config's page order.
     Args:
         json_path: Path to JSON config file
+        savePDF: Whether to build the PDF from the generated images
+        force: Re-render pages even if their output is up to date
+        engine: Floor engine, overriding the config's "engine" (default 'grid')
+        jobs: Number of pages rendered concurrently
+        encoder: Compression of JPEG and WebP outputs
     Returns:
         List of file paths for generated images
     """
@@ -308,33 +698,96 @@ def json_process(json_path: str, savePDF: bool = False) -> list:
         # Extract common settings
         rows = config['rows']
         cols = config['cols']
+        engine = engine or config.get('engine', 'grid')
 
         os.makedirs(IMAGE_OUTPUT_PATH, exist_ok=True)
+        manifest = BuildManifest(IMAGE_OUTPUT_PATH, force=force)
 
-        FileList = []
-        
-        # Process each page
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+
+        # Pages whose tiles share a file name would write the same images
+        owners = {}
+        pages = []  # (page, output paths)
+        failed_pages = []
         for page in config['pages']:
-            # Build input file path
-            in_file = page['file']
-                       
-            # Generate floor pattern
-            floor = generate_floor(
-                rows=rows,
-                cols=cols,
-                in_file=in_file,
-                rotate=page['rotate'],
-                padding=page['padding']
-            )
-            
-            # Apply perspective transform
-            floor = apply_perspective(in_file, floor, 2.5)
+            try:
+                out_files = floor_page_outputs(page)
+            except ValueError as e:
+                # A page with bad "outputs" is reported like a failed render; the others still build
+                print(f"Error rendering page {page.get('title')}: {e}")
+                failed_pages.append(page.get('title'))
+                continue
+            for out_file in out_files:
+                if out_file in owners:
+                    raise ValueError(f"{owners[out_file]} and {page['file']} both render to {out_file}")
+                owners[out_file] = page['file']
+            pages.append((page, out_files))
 
-            # Append thumbnail with title
-            floor = append_thumbnail(page['title'], in_file, floor)
-            
+        FileList = []
+        pending = {}  # index in FileList -> (page, future, output paths, build key)
+        in_flight = threading.BoundedSemaphore(max(1, jobs) * 2)
+
+        def finish(index, page, out_files, key, error):
+            if error is not None:
+                print(f"Error rendering page {page.get('title')}: {error}")
+                failed_pages.append(page.get('title'))
+                return
+            for out_file in out_files:
+                manifest.record(out_file, key)
+            manifest.rendered += 1
             # Append to list for PDF generation
-            FileList.append(f'{IMAGE_OUTPUT_PATH}{os.path.splitext(os.path.basename(in_file))[0]}.jpg')
+            FileList[index] = out_files[0]
+
+        with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+            # Process each page
+            for page, out_files in pages:
+                # Reuse the existing outputs if nothing that affects them has changed
+                key = manifest.page_key(floor_page_config(page, rows, cols, engine, encoder), [page['file']],
+                                        FLOOR_RENDERER_VERSION)
+                if all(manifest.is_current(out_file, key) for out_file in out_files):
+                    manifest.skipped += 1
+                    FileList.append(out_files[0])
+                    continue
+
+                if jobs > 1:
+                    # Bounded queue: wait for a slot before submitting the next page
+                    in_flight.acquire()
+                    future = executor.submit(process_page, page, rows, cols, engine, encoder)
+                    future.add_done_callback(lambda _: in_flight.release())
+                    pending[len(FileList)] = (page, future, out_files, key)
+                    FileList.append(None)
+                else:
+                    FileList.append(None)
+                    try:
+                        process_page(page, rows, cols, engine, encoder)
+                        error = None
+                    except Exception as e:
+                        error = e
+                    finish(len(FileList) - 1, page, out_files, key, error)
+
+            # Collect threaded results in page order
+            for index, (page, future, out_files, key) in pending.items():
+                try:
+                    future.result()
+                    error = None
+                except Exception as e:
+                    error = e
+                finish(index, page, out_files, key, error)
+
+        # Keep the pages that rendered even if others failed
+        manifest.save()
+        FileList = [out_file for out_file in FileList if out_file]
+        if failed_pages:
+            print(f"{len(failed_pages)} of {len(config['pages'])} pages failed: {', '.join(map(str, failed_pages))}")
+        print(manifest.summary())
+
+        if manifest.rendered:
+            wall_time = time.perf_counter() - wall_start
+            cpu_time = time.process_time() - cpu_start
+            print(f"Rendered {manifest.rendered} pages with {max(1, jobs)} jobs: "
+                  f"{wall_time:.2f}s wall, {cpu_time:.2f}s CPU "
+                  f"({cpu_time / wall_time if wall_time else 0:.1f}x parallelism)")
 
         if savePDF:
             make_pdf(FileList, config['output_pdf'], config['title'])
@@ -348,10 +801,12 @@ def json_process(json_path: str, savePDF: bool = False) -> list:
 
 def main():
     args = parse_args()
+    if args.profile is not None:
+        profiler.enable()
     # Handle JSON case
     if args.json:
         print(f"Processing JSON Filename: {args.json}")
-        files = json_process(args.json, args.pdf)
+        files = json_process(args.json, args.pdf, args.force, args.engine, args.jobs, encoder_from_args(args))
         
 
         
@@ -362,14 +817,15 @@ def main():
             print("Error: Missing required arguments")
         else:
             print("Direct processing\n\n")
-            floor = generate_floor(args.rows, args.cols, args.in_file,  
-                  args.rotate, args.out_file, args.padding)
-            # Apply perspective transform
-            floor = apply_perspective(args.in_file , floor, 2.5)
+            os.makedirs(IMAGE_OUTPUT_PATH, exist_ok=True)
+            floor = render_page_floor(args.rows, args.cols, args.in_file,
+                                      args.rotate, args.padding, engine=args.engine or 'grid')
 
             # Append thumbnail with title
             floor = append_thumbnail(args.title, args.in_file, floor)
 
+    profiler.report(args.profile, 'visualize_floor')
+
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,176 +1,666 @@
 import os
 import json
+import zlib
+import mmap
 import argparse
+import tempfile
+import contextlib
 from PIL import Image, ImageDraw, ImageFont
 import numpy as np
 import pathlib
+from dataclasses import dataclass
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import A4, landscape
-from reportlab.lib.utils import ImageReader
 # Add these imports for embedding fonts
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
+from image_cache import shared_cache, DEFAULT_CACHE_MB
+from build_cache import BuildManifest
+from pdf_images import fit_image_for_pdf, upright_image_for_pdf, PdfImageRegistry, EncodedJpeg, binary_streams
+from profiler import profiler, add_profile_argument
+from image_loader import upright_size
+from output_encoder import EncoderSettings, encode_image, save_image, add_encoder_arguments, encoder_from_args
 
-def create_wall_visualization(config):
-    """Create wall tile visualizations based on the provided configuration."""
+# Bump whenever a change alters the rendered pixels so cached pages are rebuilt
+WALL_RENDERER_VERSION = 3
+WALL_JPEG_QUALITY = 95
+# Page JPEGs are also embedded in the PDF as they are, so walls are always JPEG
+WALL_ENCODER = EncoderSettings(quality=WALL_JPEG_QUALITY)
+WALL_OUTPUT_PATH = "./out/visual-wall"
+DEFAULT_PDF_TITLE = 'Deltaware.in - Tiles Catalog - Whatsapp: 9940198130'
+
+# Title text drawn under the wall, in pixels
+TITLE_FONT_SIZE = 45
+# Smallest band of a banded render, in rows (one JPEG MCU row pair)
+MIN_BAND_ROWS = 16
+
+@dataclass
+class WallLayout:
+    """Geometry of one wall page in pixels (origin top-left), shared by the raster and vector renderers"""
+    title: str
+    width: int
+    height: int
+    cells: list          # (image path, x, y) for every grid cell
+    title_x: int
+    title_y: int
+    footers: list        # (image path, x, y) of every bordered footer box
+    footer_box: tuple    # (width, height) of a footer box, border included
+    border_width: int = 2
+
+def image_size(path):
+    """Pixel size of an image file as it is drawn (after EXIF orientation), read from its header"""
+    return upright_size(path)
+
+def page_seed(page):
+    """Seed for a page's random tile mix: its "seed" setting, or one derived from its title"""
+    if 'seed' in page:
+        return int(page['seed'])
+    # crc32 rather than hash() so the seed is the same in every run and process
+    return zlib.crc32(str(page['title']).encode())
+
+def plan_wall_page(page):
+    """Work out where every tile, the title and the footer images go on a wall page.
+
+    Returns None for pages without images.
+    """
+    # Create wall visualization for the page
+    title = page['title']
+    image_paths = [os.path.join(page['path'], img) for img in page['images']]
+    padding = page.get('padding', 3)
+    title_left_padding = page.get('title_padding', 30)  # New parameter for title left padding
     
-    # Create output directory for wall visualizations
-    wall_output_dir = "./out/visual-wall"
-    os.makedirs(wall_output_dir, exist_ok=True)
+    # Get random images if available
+    random_image_paths = []
+    if 'images_random' in page:
+        random_image_paths = [os.path.join(page['path'], img) for img in page['images_random']]
     
-    # List to store paths of all generated images
-    generated_images = []
+    # Get footer images if available
+    footer_images = []
+    if 'footer' in page:
+        footer_images = [os.path.join(page['path'], img) for img in page['footer']]
     
-    # Process each page in the configuration
-    for page in config['pages']:
-        # Create wall visualization for the page
-        title = page['title']
-        image_paths = [os.path.join(page['path'], img) for img in page['images']]
-        padding = page.get('padding', 3)
-        title_left_padding = page.get('title_padding', 30)  # New parameter for title left padding
-        
-        # Get random images if available
-        random_image_paths = []
-        if 'images_random' in page:
-            random_image_paths = [os.path.join(page['path'], img) for img in page['images_random']]
+    # Now get the rows from the number of images and cols from the page config
+    rows = len(image_paths)
+    cols = page.get('cols', 5)
+    
+    # Load the first image to get dimensions
+    if not image_paths:
+        print(f"No images found for page {title}")
+        return None
         
-        # Get footer images if available
-        footer_images = []
-        if 'footer' in page:
-            footer_images = [os.path.join(page['path'], img) for img in page['footer']]
+    img_width, img_height = image_size(image_paths[0])
+    
+    # Calculate the size of the output image with padding
+    total_width = cols * img_width + (cols - 1) * padding
+    total_height = rows * img_height + (rows - 1) * padding
+    
+    # Add extra height for footer and title
+    footer_height = 0
+    title_height = 50  # Height for title text (increased for 45px font)
+    footer_spacing = 30  # Spacing between main visualization and title
+    title_footer_spacing = 20  # Spacing between title and footer images
+    footer_bottom_spacing = 30  # Spacing after footer section
+    border_width = 2
+    
+    if footer_images:
+        footer_img_width, footer_img_height = image_size(footer_images[0])
+        footer_height = footer_img_height + title_footer_spacing + footer_bottom_spacing
+    
+    # Add space for title row and footer at the bottom
+    final_height = total_height + footer_height + title_height + footer_spacing
+    
+    # Assign an image to every cell: each row repeats its own image, and with
+    # random images the odd cells (checkerboard) get one drawn from the page's own
+    # seeded generator, so the same config always gives the same wall
+    sources = image_paths + random_image_paths
+    row_index, col_index = np.indices((rows, cols))
+    assignment = row_index % len(image_paths)
+    if random_image_paths:
+        rng = np.random.default_rng(page_seed(page))
+        drawn = len(image_paths) + rng.integers(len(random_image_paths), size=(rows, cols))
+        assignment = np.where((row_index + col_index) % 2 == 1, drawn, assignment)
+    
+    # Place the tiles on the canvas
+    cells = []
+    for row in range(rows):
+        for col in range(cols):
+            x = col * (img_width + padding)
+            y = row * (img_height + padding)
+            cells.append((sources[assignment[row, col]], x, y))
+    
+    # Calculate positions for footer section
+    title_start_y = total_height + footer_spacing
+    footer_start_y = title_start_y + title_height + title_footer_spacing
+    
+    # Footer images in their own row (below the title), left aligned with the title
+    # and spaced a fixed 20px apart
+    footers = []
+    footer_box = (0, 0)
+    if footer_images:
+        spacing = 20
+        start_x = title_left_padding
+        footer_box = (footer_img_width + 2*border_width, footer_img_height + 2*border_width)
+        for i, footer_path in enumerate(footer_images):
+            x = start_x + i * (footer_img_width + spacing)
+            footers.append((footer_path, x, footer_start_y))
+    
+    return WallLayout(title=title, width=total_width, height=final_height, cells=cells,
+                      title_x=title_left_padding, title_y=title_start_y,
+                      footers=footers, footer_box=footer_box, border_width=border_width)
+
+def _wall_tiles(cache):
+    """Decode-once lookup of a page's tiles: every distinct image (cell or footer) is decoded once for the page"""
+    if cache is None:
+        cache = shared_cache
+    tiles = {}
+    def tile(path):
+        if path not in tiles:
+            tiles[path] = cache.get(path)
+        return tiles[path]
+    return tile
+
+def _title_font():
+    # Try to use a system font with 45px size
+    with profiler.stage('font'):
+        try:
+            return ImageFont.truetype("arial.ttf", TITLE_FONT_SIZE)
+        except:
+            return ImageFont.load_default()
+
+def render_wall_band(layout, top, height, tile, font, failed=None):
+    """Rasterize rows top to top + height of a planned wall page into an RGB image
+    Args:
+        layout: WallLayout of the page
+        top: First row of the band
+        height: Rows in the band
+        tile: Image lookup from _wall_tiles
+        font: Title font
+        failed: Set of image paths that could not be pasted, so later bands skip them quietly
+    Returns:
+        The band as an RGB image of layout.width x height
+    """
+    if failed is None:
+        failed = set()
+    bottom = top + height
+    
+    # Create a blank canvas
+    wall_image = Image.new('RGB', (layout.width, height), color='white')
+    
+    with profiler.stage('paste'):
+        for img_path, x, y in layout.cells:
+            if y >= bottom or img_path in failed:
+                continue  # Below this band (decoded when a later band reaches it)
+            try:
+                img = tile(img_path)
+                if y + img.height > top:
+                    wall_image.paste(img, (x, y - top))
+            except Exception as e:
+                failed.add(img_path)
+                print(f"Error processing image {img_path}: {e}")
+    
+    # Add title text first (above footer images)
+    try:
+        draw = ImageDraw.Draw(wall_image)
         
-        # Now get the rows from the number of images and cols from the page config
-        rows = len(image_paths)
-        cols = page.get('cols', 5)
+        # Draw the title text on the left with the specified padding
+        with profiler.stage('title'):
+            draw.text((layout.title_x, layout.title_y - top), layout.title, fill="black", font=font)
         
-        # Load the first image to get dimensions
-        if not image_paths:
-            print(f"No images found for page {title}")
-            continue
-            
+    except Exception as e:
+        print(f"Error adding title text: {e}")
+    
+    # Add footer images with a border
+    with profiler.stage('footer'):
+        for footer_path, x, y in layout.footers:
+            if y >= bottom or y + layout.footer_box[1] <= top or footer_path in failed:
+                continue
+            try:
+                footer_img = tile(footer_path)
+                bordered_img = Image.new('RGB', layout.footer_box, color='white')
+                bordered_img.paste(footer_img, (layout.border_width, layout.border_width))
+                wall_image.paste(bordered_img, (x, y - top))
+            except Exception as e:
+                failed.add(footer_path)
+                print(f"Error processing footer image {footer_path}: {e}")
+    
+    return wall_image
+
+def render_wall_image(layout, cache=None):
+    """Rasterize a planned wall page into an RGB image"""
+    return render_wall_band(layout, 0, layout.height, _wall_tiles(cache), _title_font())
+
+def wall_band_rows(layout, max_memory):
+    """Rows per band for banded rendering, or None when the whole page fits in max_memory bytes
+    The budget covers the decoded tiles of the page plus one band, which is
+    held twice while it is copied to the page frame.
+    """
+    if not max_memory:
+        return None
+    row_bytes = layout.width * 4  # Pillow keeps RGB images at 4 bytes per pixel
+    if layout.height * row_bytes <= max_memory:
+        return None
+    sources = {path for path, _, _ in layout.cells} | {path for path, _, _ in layout.footers}
+    tile_bytes = 0
+    for path in sources:
         try:
-            first_image = Image.open(image_paths[0])
-            img_width, img_height = first_image.size
-            
-            # Calculate the size of the output image with padding
-            total_width = cols * img_width + (cols - 1) * padding
-            total_height = rows * img_height + (rows - 1) * padding
-            
-            # Add extra height for footer and title
-            footer_height = 0
-            title_height = 50  # Height for title text (increased for 45px font)
-            footer_spacing = 30  # Spacing between main visualization and title
-            title_footer_spacing = 20  # Spacing between title and footer images
-            footer_bottom_spacing = 30  # Spacing after footer section
-            
-            if footer_images:
-                footer_img = Image.open(footer_images[0])
-                footer_img_width, footer_img_height = footer_img.size
-                footer_height = footer_img_height + title_footer_spacing + footer_bottom_spacing
-            
-            # Add space for title row and footer at the bottom
-            final_height = total_height + footer_height + title_height + footer_spacing
-            
-            # Create a blank canvas
-            wall_image = Image.new('RGB', (total_width, final_height), color='white')
-            
-            # Place the tiles on the canvas
-            current_row_img_idx = 0  # Track the current image index for the row
-            for row in range(rows):
-                # Determine which image to use for this row
-                if row < len(image_paths):
-                    current_row_img_idx = row
-                else:
-                    # If we've used all images, restart from the first image
-                    current_row_img_idx = row % len(image_paths)
-                    
-                img_path = image_paths[current_row_img_idx]
-                
-                for col in range(cols):
-                    if random_image_paths:
-                        # Pattern: original image at even positions, random at odd positions
-                        if (row + col) % 2 == 0:
-                            # Use the current row's main image
-                            current_img_path = img_path
-                        else:
-                            # Use a random image from the random_image_paths
-                            # Use a consistent seed for reproducibility but still get variety
-                            np.random.seed((row + 1) * (col + 1) + np.random.randint(100))
-                            current_img_path = np.random.choice(random_image_paths)
-                    else:
-                        # Without random images, just repeat the row's main image across all columns
-                        current_img_path = img_path
-                    
-                    try:
-                        img = Image.open(current_img_path)
-                        x = col * (img_width + padding)
-                        y = row * (img_height + padding)
-                        wall_image.paste(img, (x, y))
-                    except Exception as e:
-                        print(f"Error processing image {current_img_path}: {e}")
-            
-            # Calculate positions for footer section
-            title_start_y = total_height + footer_spacing
-            footer_start_y = title_start_y + title_height + title_footer_spacing
-            
-            # Add title text first (above footer images)
+            width, height = image_size(path)
+            tile_bytes += width * height * 4
+        except OSError:
+            pass  # Reported when the band tries to paste it
+    return max(MIN_BAND_ROWS, (max_memory - tile_bytes) // (2 * row_bytes))
+
+@contextlib.contextmanager
+def wall_canvas(layout, cache=None, max_memory=None, temp_dir=None):
+    """Render a planned wall page, yielding the image to encode while it is valid
+    Pages that fit in max_memory bytes (or all pages, without a budget) are
+    rendered in one piece by render_wall_image. Larger ones are composed one
+    horizontal band at a time into an uncompressed RGBX frame in a temporary
+    file under temp_dir, which is memory mapped and handed to the encoder as a
+    read-only image, so only one band and the page's tiles are ever held in RAM;
+    the operating system pages the frame in and out while it is encoded.
+    """
+    band_rows = wall_band_rows(layout, max_memory)
+    if band_rows is None:
+        yield render_wall_image(layout, cache)
+        return
+    
+    width, height = layout.width, layout.height
+    tile, font, failed = _wall_tiles(cache), _title_font(), set()
+    with tempfile.TemporaryFile(dir=temp_dir, suffix='.wall') as f:
+        f.truncate(width * height * 4)
+        frame_file = mmap.mmap(f.fileno(), width * height * 4)
+        try:
+            for top in range(0, height, band_rows):
+                band = render_wall_band(layout, top, min(band_rows, height - top), tile, font, failed)
+                with profiler.stage('band'):
+                    frame_file[top * width * 4:(top + band.height) * width * 4] = band.tobytes('raw', 'RGBX')
+                del band
+                if hasattr(frame_file, 'madvise'):
+                    # Written bands are in the file; drop them from this process until the encoder reads them
+                    end = min(top + band_rows, height) * width * 4
+                    frame_file.madvise(mmap.MADV_DONTNEED, 0, end // mmap.PAGESIZE * mmap.PAGESIZE)
+            if hasattr(frame_file, 'madvise'):
+                frame_file.madvise(mmap.MADV_SEQUENTIAL)
+            wall_image = Image.frombuffer('RGBX', (width, height), frame_file, 'raw', 'RGBX', 0, 1)
             try:
-                draw = ImageDraw.Draw(wall_image)
-                # Try to use a system font with 45px size
+                yield wall_image
+            finally:
+                del wall_image
+        finally:
+            try:
+                frame_file.close()
+            except BufferError:
+                pass  # The caller still holds the image; the frame is unmapped when it is freed
+
+def draw_wall_vector(c, registry, layout, x, y, width, height):
+    """Draw a planned wall page into the box (x, y, width, height) of a PDF canvas.
+
+    Each distinct tile is embedded once through the registry and placed at every
+    cell with a transform; grout, the title and the footer boxes are native PDF
+    operations, so nothing is rasterized at wall resolution.
+    """
+    scale = width / layout.width
+    
+    def box(px, py, pw, ph):
+        # Wall pixels (top-left origin) -> PDF points (bottom-left origin)
+        return x + px * scale, y + height - (py + ph) * scale, pw * scale, ph * scale
+    
+    c.saveState()
+    clip = c.beginPath()
+    clip.rect(x, y, width, height)
+    c.clipPath(clip, stroke=0, fill=0)
+    
+    # White background shows through as the grout between tiles
+    c.setFillColorRGB(1, 1, 1)
+    c.rect(x, y, width, height, stroke=0, fill=1)
+    
+    sizes = {}
+    for img_path, px, py in layout.cells:
+        try:
+            if img_path not in sizes:
+                sizes[img_path] = image_size(img_path)
+            registry.draw(lambda: upright_image_for_pdf(img_path), *box(px, py, *sizes[img_path]), source_key=img_path)
+        except Exception as e:
+            print(f"Error processing image {img_path}: {e}")
+    
+    # Title: PIL places the top of the text at title_y, PDF wants the baseline
+    c.setFillColorRGB(0, 0, 0)
+    c.setFont("Helvetica", TITLE_FONT_SIZE * scale)
+    c.drawString(x + layout.title_x * scale,
+                 y + height - (layout.title_y + TITLE_FONT_SIZE * 0.9) * scale, layout.title)
+    
+    border = layout.border_width
+    for footer_path, px, py in layout.footers:
+        try:
+            c.saveState()
+            c.setFillColorRGB(1, 1, 1)
+            fx, fy, fw, fh = box(px, py, *layout.footer_box)
+            footer_clip = c.beginPath()
+            footer_clip.rect(fx, fy, fw, fh)
+            c.clipPath(footer_clip, stroke=0, fill=1)
+            if footer_path not in sizes:
+                sizes[footer_path] = image_size(footer_path)
+            registry.draw(lambda: upright_image_for_pdf(footer_path), *box(px + border, py + border, *sizes[footer_path]),
+                          source_key=footer_path)
+        except Exception as e:
+            print(f"Error processing footer image {footer_path}: {e}")
+        finally:
+            c.restoreState()
+    
+    c.restoreState()
+
+def render_wall_page(page, output_dir, cache=None, encoder=WALL_ENCODER, max_memory=None):
+    """Render a single wall page to a JPEG and return its path.
+
+    Returns None for pages without images. Errors are raised to the caller so
+    batch runs can report them per page. encoder sets the JPEG compression
+    (see output_encoder.EncoderSettings); pages bigger than max_memory bytes
+    are rendered in bands (see wall_canvas).
+    """
+    with profiler.stage('page', page=page.get('title')):
+        with profiler.stage('plan'):
+            layout = plan_wall_page(page)
+        if layout is None:
+            return None
+        
+        # Save the visualization
+        output_path = os.path.join(output_dir, f"{layout.title}.jpg")
+        with wall_canvas(layout, cache, max_memory, output_dir) as wall_image:
+            encoded = save_image(wall_image, output_path, encoder)
+    print(f"Created wall visualization: {output_path}")
+    if encoder.min_ssim is not None:
+        print(f"  {encoded.report(layout.title)}")
+    return output_path
+
+def encode_wall_page(page, output_dir=None, cache=None, encoder=WALL_ENCODER, max_memory=None):
+    """Render a wall page straight to JPEG bytes, also saving them to output_dir if given
+    Returns:
+        (JPEG bytes, output path or None), or None for pages without images
+    """
+    with profiler.stage('page', page=page.get('title')):
+        with profiler.stage('plan'):
+            layout = plan_wall_page(page)
+        if layout is None:
+            return None
+        with wall_canvas(layout, cache, max_memory, output_dir) as wall_image:
+            encoded = encode_image(wall_image, encoder)
+        data = encoded.data
+    
+    output_path = None
+    if output_dir:
+        output_path = os.path.join(output_dir, f"{layout.title}.jpg")
+        with open(output_path, 'wb') as f:
+            f.write(data)
+        print(f"Created wall visualization: {output_path}")
+    if encoder.min_ssim is not None:
+        print(f"  {encoded.report(layout.title)}")
+    return data, output_path
+
+def _init_page_worker(cache_bytes, profile=False):
+    """Process pool initializer: size the worker's own image cache"""
+    shared_cache.set_budget(cache_bytes)
+    if profile:
+        profiler.enable()
+
+def _worker_job(job, *args):
+    """Run a page job in a pool worker, handing its profile events back with the result"""
+    return job(*args), profiler.take_events()
+
+def _render_page_job(page, output_dir, cache=None, encoder=WALL_ENCODER, max_memory=None):
+    """Render one page, returning (output_path, error) instead of raising"""
+    try:
+        return render_wall_page(page, output_dir, cache, encoder, max_memory), None
+    except Exception as e:
+        return None, str(e)
+
+def _encode_page_job(page, output_dir=None, cache=None, encoder=WALL_ENCODER, max_memory=None):
+    """Encode one page, returning (result, error) instead of raising"""
+    try:
+        return encode_wall_page(page, output_dir, cache, encoder, max_memory), None
+    except Exception as e:
+        return None, str(e)
+
+def wall_page_config(page, encoder=WALL_ENCODER):
+    """Return the page config with renderer defaults filled in (used for build hashes)"""
+    effective = dict(page)
+    effective.setdefault('padding', 3)
+    effective.setdefault('title_padding', 30)
+    effective.setdefault('cols', 5)
+    if encoder != WALL_ENCODER:
+        effective['encoder'] = encoder.key()
+    return effective
+
+def wall_page_sources(page):
+    """Return every image file a wall page reads"""
+    names = page.get('images', []) + page.get('images_random', []) + page.get('footer', [])
+    return [os.path.join(page['path'], img) for img in names]
+
+def wall_pdf_path(config_file, print_ready=False, page_count=None):
+    """PDF path for a wall config, named after the JSON file (visualize-wall-bath.json -> out/visualize-wall-bath.pdf)"""
+    base_name = pathlib.Path(config_file).stem.replace('visualize-wall-', '')
+    if not print_ready:
+        return f"./out/visualize-wall-{base_name}.pdf"
+    # Include page count in filename if specified
+    if page_count:
+        return f"./out/visualize-wall-{base_name}-print-{page_count}.pdf"
+    return f"./out/visualize-wall-{base_name}-print.pdf"
+
+def wall_pdf_options(config):
+    """PDF settings a wall config can set for build_catalogs.py, like visualize_wall's --cover, --print and --dpi
+    "print" is true for a print-ready PDF, or the page count to pad it to.
+    Returns:
+        Keyword arguments for generate_pdf
+    """
+    print_pages = config.get('print', False)
+    if not (isinstance(print_pages, bool) or (isinstance(print_pages, int) and print_pages > 0)):
+        raise ValueError(f"'print' must be true, false or a page count, not {print_pages!r}")
+    dpi = config.get('dpi')
+    if dpi is not None and (isinstance(dpi, bool) or not isinstance(dpi, (int, float)) or dpi <= 0):
+        raise ValueError(f"'dpi' must be a positive number, not {dpi!r}")
+    return {'cover_image_path': config.get('cover'), 'print_ready': print_pages is not False,
+            'page_count': None if isinstance(print_pages, bool) else print_pages, 'dpi': dpi}
+
+def create_wall_visualization(config, cache=None, jobs=1, force=False, encoder=WALL_ENCODER, max_memory=None):
+    """Create wall tile visualizations based on the provided configuration.
+
+    Source images are decoded through a shared ImageCache so a tile reused across
+    cells, footers and pages is decoded only once per run. With jobs > 1 pages are
+    rendered in a process pool; the returned paths keep the config's page order.
+    Pages whose config, source images, renderer version and encoder settings
+    are unchanged since the last run reuse their existing output unless force is set.
+    With max_memory (bytes) set, each page bigger than that is rendered in bands.
+    """
+    if cache is None:
+        cache = shared_cache
+    
+    # Create output directory for wall visualizations
+    wall_output_dir = WALL_OUTPUT_PATH
+    os.makedirs(wall_output_dir, exist_ok=True)
+    manifest = BuildManifest(wall_output_dir, force=force)
+    
+    pages = config['pages']
+    results = [None] * len(pages)  # (output_path, error) per page, in config order
+    keys = [None] * len(pages)
+    
+    # Skip pages that are already up to date
+    pending = []
+    for i, page in enumerate(pages):
+        try:
+            keys[i] = manifest.page_key(wall_page_config(page, encoder), wall_page_sources(page), WALL_RENDERER_VERSION)
+            output_path = os.path.join(wall_output_dir, f"{page['title']}.jpg")
+            if manifest.is_current(output_path, keys[i]):
+                results[i] = (output_path, None)
+                manifest.skipped += 1
+                continue
+        except (KeyError, TypeError):
+            pass  # Malformed page, let the renderer report it
+        pending.append(i)
+    
+    if jobs > 1 and len(pending) > 1:
+        with ProcessPoolExecutor(max_workers=jobs, initializer=_init_page_worker,
+                                 initargs=(cache.max_bytes, profiler.enabled)) as executor:
+            futures = {i: executor.submit(_worker_job, _render_page_job, pages[i], wall_output_dir, None, encoder,
+                                          max_memory)
+                       for i in pending}
+            for i, future in futures.items():
                 try:
-                    font = ImageFont.truetype("arial.ttf", 45)
-                except:
-                    font = ImageFont.load_default()
-                
-                # Draw the title text on the left with the specified padding
-                draw.text((title_left_padding, title_start_y), title, fill="black", font=font)
-                
-            except Exception as e:
-                print(f"Error adding title text: {e}")
-            
-            # Add footer images with black border in their own row (below the title)
-            if footer_images:
-                footer_img = Image.open(footer_images[0])
-                footer_img_width, footer_img_height = footer_img.size
-                
-                # Fixed spacing of 20px between footer images
-                spacing = 20
-                
-                # Left align the footer images (start from the same left padding as title)
-                start_x = title_left_padding
-                
-                for i, footer_path in enumerate(footer_images):
-                    if i >= len(footer_images):
-                        break  # Only show as many as available
-                        
-                    try:
-                        footer_img = Image.open(footer_path)
-                        # Add black border to footer image
-                        border_width = 2
-                        bordered_img = Image.new('RGB', 
-                                              (footer_img_width + 2*border_width, 
-                                              footer_img_height + 2*border_width), 
-                                              color='white')
-                        bordered_img.paste(footer_img, (border_width, border_width))
-                        
-                        x = start_x + i * (footer_img_width + spacing)
-                        wall_image.paste(bordered_img, (x, footer_start_y))
-                    except Exception as e:
-                        print(f"Error processing footer image {footer_path}: {e}")
-            
-            # Save the visualization
-            output_path = os.path.join(wall_output_dir, f"{title}.jpg")
-            wall_image.save(output_path, quality=95)
+                    results[i], events = future.result()
+                    profiler.merge(events)
+                except Exception as e:
+                    # The worker itself died (e.g. killed by the OS)
+                    results[i] = (None, str(e))
+    else:
+        for i in pending:
+            results[i] = _render_page_job(pages[i], wall_output_dir, cache, encoder, max_memory)
+    
+    for i in pending:
+        output_path, error = results[i]
+        if output_path and error is None and keys[i]:
+            manifest.record(output_path, keys[i])
+            manifest.rendered += 1
+    manifest.save()
+    
+    # List to store paths of all generated images
+    generated_images = []
+    failed_pages = []
+    for page, (output_path, error) in zip(pages, results):
+        if error is not None:
+            print(f"Error creating visualization for {page.get('title')}: {error}")
+            failed_pages.append(page.get('title'))
+        elif output_path:
             generated_images.append(output_path)
-            print(f"Created wall visualization: {output_path}")
+    
+    if failed_pages:
+        print(f"{len(failed_pages)} of {len(pages)} pages failed: {', '.join(map(str, failed_pages))}")
+    print(manifest.summary())
+    if jobs <= 1:
+        print(cache.summary())
+    return generated_images
+
+def iter_wall_pages(config, cache=None, jobs=1, force=False, save_images=True, encoder=WALL_ENCODER,
+                    max_memory=None):
+    """Render wall pages one at a time and yield them as EncodedJpeg, in config order.
+
+    Meant to feed generate_pdf directly: only about one page per worker is held
+    in memory, and each page goes into the PDF as the JPEG bytes it was encoded
+    to, without a round trip through disk. With save_images the page JPEGs are
+    also written (and tracked in the build manifest) as create_wall_visualization
+    does; pages that are already up to date are read back instead of rendered.
+    """
+    if cache is None:
+        cache = shared_cache
+    
+    wall_output_dir = WALL_OUTPUT_PATH
+    os.makedirs(wall_output_dir, exist_ok=True)
+    manifest = BuildManifest(wall_output_dir, force=force)
+    output_dir = wall_output_dir if save_images else None
+    
+    def start(page):
+        try:
+            key = manifest.page_key(wall_page_config(page, encoder), wall_page_sources(page), WALL_RENDERER_VERSION)
+            output_path = os.path.join(wall_output_dir, f"{page['title']}.jpg")
+            if manifest.is_current(output_path, key):
+                with open(output_path, 'rb') as f:
+                    manifest.skipped += 1
+                    return key, False, ((f.read(), output_path), None)
+        except (KeyError, TypeError, OSError):
+            key = None  # Malformed page, let the renderer report it
+        if executor:
+            return key, True, executor.submit(_worker_job, _encode_page_job, page, output_dir, None, encoder, max_memory)
+        return key, True, _encode_page_job(page, output_dir, cache, encoder, max_memory)
+    
+    executor = ProcessPoolExecutor(max_workers=jobs, initializer=_init_page_worker,
+                                   initargs=(cache.max_bytes, profiler.enabled)) if jobs > 1 else None
+    failed_pages = []
+    try:
+        pages = deque(config['pages'])
+        in_flight = deque()
+        while pages or in_flight:
+            # Keep every worker busy, but no more pages than that in memory
+            while pages and len(in_flight) < max(jobs, 1):
+                page = pages.popleft()
+                in_flight.append((page, *start(page)))
             
+            page, key, rendered, outcome = in_flight.popleft()
+            if not isinstance(outcome, tuple):
+                try:
+                    outcome, events = outcome.result()
+                    profiler.merge(events)
+                except Exception as e:
+                    outcome = (None, str(e))
+            result, error = outcome
+            if error is not None:
+                print(f"Error creating visualization for {page.get('title')}: {error}")
+                failed_pages.append(page.get('title'))
+                continue
+            if result is None:
+                continue
+            data, output_path = result
+            if rendered and output_path and key:
+                manifest.record(output_path, key)
+                manifest.rendered += 1
+            yield EncodedJpeg(data)
+    finally:
+        if executor:
+            executor.shutdown(cancel_futures=True)
+        if save_images:
+            manifest.save()
+        if failed_pages:
+            print(f"{len(failed_pages)} of {len(config['pages'])} pages failed: {', '.join(map(str, failed_pages))}")
+        print(manifest.summary())
+
+def plan_wall_layouts(pages):
+    """Plan every page for a vector PDF, reporting pages that fail and keeping the rest"""
+    layouts = []
+    failed_pages = []
+    for page in pages:
+        try:
+            layout = plan_wall_page(page)
         except Exception as e:
-            print(f"Error creating visualization for {title}: {e}")
-            
-    return generated_images
+            print(f"Error creating visualization for {page.get('title')}: {e}")
+            failed_pages.append(page.get('title'))
+            continue
+        if layout:
+            layouts.append(layout)
+    if failed_pages:
+        print(f"{len(failed_pages)} of {len(pages)} pages failed: {', '.join(map(str, failed_pages))}")
+    return layouts
 
-def generate_pdf(image_paths, pdf_path, title='', cover_image_path=None, print_ready=False, page_count=None):
-    """Generate a PDF containing all the generated images (2 per page)."""
+def _page_item_size(item):
+    """Pixel size of a PDF page item: a rendered wall image path or a WallLayout"""
+    if isinstance(item, WallLayout):
+        return item.width, item.height
+    if isinstance(item, EncodedJpeg):
+        return item.getSize()
+    return image_size(item)
+
+def _draw_page_item(c, registry, item, x, y, width, height, dpi):
+    """Draw a rendered wall image, or a WallLayout as vectors, into a PDF box"""
+    if isinstance(item, WallLayout):
+        with profiler.stage('pdf.vector', page=item.title):
+            draw_wall_vector(c, registry, item, x, y, width, height)
+    elif isinstance(item, EncodedJpeg):
+        registry.draw(fit_image_for_pdf(item, width, height, dpi), x, y, width, height)
+    else:
+        registry.draw(lambda: fit_image_for_pdf(item, width, height, dpi), x, y, width, height,
+                      source_key=(item, width, height, dpi))
+
+@binary_streams()
+def generate_pdf(image_paths, pdf_path, title='', cover_image_path=None, print_ready=False, page_count=None, dpi=None,
+                 image_count=None):
+    """Generate a PDF containing all the generated images (2 per page).
+
+    image_paths may also hold WallLayout objects, which are drawn as vectors
+    (see draw_wall_vector) instead of embedding a rendered wall, or EncodedJpeg
+    pages. It can be any iterable, such as iter_wall_pages(), as long as
+    image_count gives the expected number of images; the page total is then
+    filled in once the iterable is exhausted, as pages may fail on the way,
+    and the iterable is closed when the PDF is done. Images are embedded at
+    their placed size: with dpi set, anything larger is downsampled to that
+    resolution, and JPEGs that already fit keep their original DCT stream.
+    """
     try:
         # Create the PDF with US Letter (8.5" x 11") size
         # 1 inch = 72 points, so 8.5" x 11" = 612 x 792 points
@@ -188,8 +678,10 @@ def generate_pdf(image_paths, pdf_path, title='', cover_image_path=None, print_r
             except Exception as e:
                 print(f"Warning: Could not embed fonts: {e}. Using default fonts.")
         
-        # Create PDF with print-ready settings if needed
+        # Create PDF with print-ready settings if needed (--vector renders nothing that would create ./out first)
+        os.makedirs(os.path.dirname(pdf_path) or '.', exist_ok=True)
         c = canvas.Canvas(pdf_path, pagesize=letter_size)
+        registry = PdfImageRegistry(c)
         if print_ready:
             # Set PDF metadata for print-ready document
             c.setTitle(f"Print-Ready Tile Catalog - {title}")
@@ -202,17 +694,37 @@ def generate_pdf(image_paths, pdf_path, title='', cover_image_path=None, print_r
         
         # Calculate how many pages we'll need for images (2 images per page)
         has_cover = cover_image_path and os.path.exists(cover_image_path)
-        actual_pages = (len(image_paths) + 1) // 2
+        # A stream may deliver fewer images than expected, so its total is only known at the end
+        streamed = not isinstance(image_paths, (list, tuple))
+        if image_count is None:
+            image_count = len(image_paths)
+        images = iter(image_paths)
+        actual_pages = (image_count + 1) // 2
         total_actual_pages = actual_pages + (1 if has_cover else 0)
         
         # If page_count is specified and greater than actual pages, we'll add empty pages
         total_pages_to_generate = max(total_actual_pages, page_count or 0)
-        if page_count and page_count > total_actual_pages:
-            print(f"Adding {page_count - total_actual_pages} empty pages to meet requested page count of {page_count}")
         
         # Calculate the final total pages for page numbering
         total_pages_with_cover = total_pages_to_generate 
         
+        def draw_page_number(page_number):
+            # Add page number at bottom center
+            c.setFont("Helvetica", 10)
+            page_text = f"Page {page_number} of {total_pages_with_cover}"
+            text_width = c.stringWidth(page_text, "Helvetica", 10)
+            if not streamed:
+                c.drawString((width - text_width) / 2, margin + 5, page_text)
+                return
+            # Centered for the expected total; the real one is a form drawn after the last page
+            prefix = f"Page {page_number} of "
+            x = (width - text_width) / 2
+            c.drawString(x, margin + 5, prefix)
+            c.saveState()
+            c.translate(x + c.stringWidth(prefix, "Helvetica", 10), margin + 5)
+            c.doForm('page_total')
+            c.restoreState()
+        
         # Add cover page if provided
         if cover_image_path and os.path.exists(cover_image_path):
             try:
@@ -239,7 +751,8 @@ def generate_pdf(image_paths, pdf_path, title='', cover_image_path=None, print_r
                 x = margin + (usable_width - new_width) / 2
                 y = margin + (usable_height - new_height) / 2
                 
-                c.drawImage(ImageReader(cover_img), x, y, width=new_width, height=new_height)
+                registry.draw(lambda: fit_image_for_pdf(cover_image_path, new_width, new_height, dpi), x, y, new_width, new_height,
+                              source_key=(cover_image_path, new_width, new_height, dpi))
                 c.showPage()  # Finish the cover page and start a new page
                 
             except Exception as e:
@@ -260,8 +773,16 @@ def generate_pdf(image_paths, pdf_path, title='', cover_image_path=None, print_r
         single_image_height = (image_area_height - 5) / 2
         
         # Process images two at a time
-        for i in range(0, len(image_paths), 2):
+        image_pages = 0
+        for i in range(0, image_count, 2):
+            img1_path = next(images, None)
+            if img1_path is None:
+                break  # Fewer images arrived than expected (failed pages)
+            if image_pages:
+                c.showPage()  # Finish the previous image page
+            
             # Calculate page number considering the cover page
+            image_pages += 1
             page_num = (i // 2) + 1
             page_num_with_cover = page_num + (1 if cover_image_path and os.path.exists(cover_image_path) else 0)
             
@@ -272,11 +793,8 @@ def generate_pdf(image_paths, pdf_path, title='', cover_image_path=None, print_r
             c.drawString(margin + (usable_width - text_width) / 2, height - margin - 15, header_text)
             
             # Add the first image
-            img1_path = image_paths[i]
-            img1 = Image.open(img1_path)
-            
             # Calculate dimensions for the first image
-            img1_width, img1_height = img1.size
+            img1_width, img1_height = _page_item_size(img1_path)
             img1_ratio = img1_width / img1_height
             
             new_height1 = single_image_height
@@ -289,15 +807,13 @@ def generate_pdf(image_paths, pdf_path, title='', cover_image_path=None, print_r
             x1 = margin + (usable_width - new_width1) / 2
             y1 = height - margin - header_height - new_height1
             
-            c.drawImage(ImageReader(img1), x1, y1, width=new_width1, height=new_height1)
+            _draw_page_item(c, registry, img1_path, x1, y1, new_width1, new_height1, dpi)
             
             # Add second image if available
-            if i + 1 < len(image_paths):
-                img2_path = image_paths[i + 1]
-                img2 = Image.open(img2_path)
-                
+            img2_path = next(images, None) if i + 1 < image_count else None
+            if img2_path is not None:
                 # Calculate dimensions for second image
-                img2_width, img2_height = img2.size
+                img2_width, img2_height = _page_item_size(img2_path)
                 img2_ratio = img2_width / img2_height
                 
                 new_height2 = single_image_height
@@ -310,17 +826,16 @@ def generate_pdf(image_paths, pdf_path, title='', cover_image_path=None, print_r
                 x2 = margin + (usable_width - new_width2) / 2
                 y2 = margin + footer_height
                 
-                c.drawImage(ImageReader(img2), x2, y2, width=new_width2, height=new_height2)
+                _draw_page_item(c, registry, img2_path, x2, y2, new_width2, new_height2, dpi)
             
-            # Add page number at bottom center
-            c.setFont("Helvetica", 10)
-            page_text = f"Page {page_num_with_cover} of {total_pages_with_cover}"
-            text_width = c.stringWidth(page_text, "Helvetica", 10)
-            c.drawString((width - text_width) / 2, margin + 5, page_text)
-            
-            # Add a new page if there are more images to come
-            if i + 2 < len(image_paths):
-                c.showPage()
+            draw_page_number(page_num_with_cover)
+        
+        # Pad against the pages that were actually drawn
+        total_actual_pages = image_pages + (1 if has_cover else 0)
+        total_pages_to_generate = max(total_actual_pages, page_count or 0)
+        if page_count and page_count > total_actual_pages:
+            print(f"Adding {page_count - total_actual_pages} empty pages to meet requested page count of {page_count}")
+        total_pages_with_cover = total_pages_to_generate
         
         # Add empty pages if needed to meet the specified page count
         for j in range(total_actual_pages, total_pages_to_generate):
@@ -334,18 +849,26 @@ def generate_pdf(image_paths, pdf_path, title='', cover_image_path=None, print_r
             c.drawString(margin + (usable_width - text_width) / 2, height - margin - 15, header_text)
             
             # Add page number at bottom center for empty pages too
+            draw_page_number(j + 1)
+        
+        if streamed:
+            c.beginForm('page_total', lowery=-5, upperx=100, uppery=15)
             c.setFont("Helvetica", 10)
-            empty_page_num = j + 1
-            page_text = f"Page {empty_page_num} of {total_pages_with_cover}"
-            text_width = c.stringWidth(page_text, "Helvetica", 10)
-            c.drawString((width - text_width) / 2, margin + 5, page_text)
+            c.drawString(0, 0, str(total_pages_with_cover))
+            c.endForm()
         
         # Save the PDF
-        c.save()
+        with profiler.stage('pdf.save'):
+            c.save()
+        print(registry.summary())
         print(f"Created PDF: {pdf_path} with {total_pages_to_generate} total pages")
         
     except Exception as e:
         print(f"Error generating PDF: {e}")
+    finally:
+        # Finish a streaming renderer now (saves its build manifest) rather than at garbage collection
+        if hasattr(image_paths, 'close'):
+            image_paths.close()
 
 def main():
     """Main entry point for the script."""
@@ -355,39 +878,70 @@ def main():
     parser.add_argument('--cover', help='Path to the cover image to use as the first page of the PDF')
     parser.add_argument('--print', nargs='?', const=None, type=int, metavar='PAGE_COUNT',
                         help='Generate a print-ready PDF with embedded fonts. Optional: specify total page count.')
+    parser.add_argument('--cache-mb', type=int, default=DEFAULT_CACHE_MB,
+                        help=f'Memory budget in MB for decoded source images (default: {DEFAULT_CACHE_MB})')
+    parser.add_argument('--jobs', type=int, default=1, metavar='N',
+                        help='Render pages in N worker processes (default: 1)')
+    parser.add_argument('--force', action='store_true',
+                        help='Re-render every page even if its output is up to date')
+    parser.add_argument('--dpi', type=int, default=None,
+                        help='Downsample PDF images to this resolution at their placed size (e.g. 300 for print, 150 for WhatsApp)')
+    parser.add_argument('--vector', action='store_true',
+                        help='Build the PDF from the tile images directly instead of rendered wall JPEGs (implies --pdf)')
+    parser.add_argument('--stream', action='store_true',
+                        help='Write each page into the PDF as soon as it is rendered (implies --pdf)')
+    parser.add_argument('--no-jpeg', action='store_true',
+                        help='With --stream, do not save the per-page JPEGs to out/visual-wall')
+    parser.add_argument('--max-memory', type=int, default=None, metavar='MB',
+                        help='Render pages bigger than this in horizontal bands through a temporary file, '
+                             'keeping one band and the decoded tiles in memory (baseline JPEG only: not with '
+                             '--min-ssim, --progressive or --optimize)')
+    add_encoder_arguments(parser)
+    add_profile_argument(parser)
     args = parser.parse_args()
+    if args.max_memory and args.min_ssim is not None:
+        parser.error('--min-ssim compares whole pages in memory and cannot be used with --max-memory')
+    if args.max_memory and (args.progressive or args.optimize):
+        parser.error('--progressive and --optimize make libjpeg buffer the whole page and cannot be used with --max-memory')
+    encoder = encoder_from_args(args, quality=WALL_JPEG_QUALITY)
+    max_memory = args.max_memory * 1024 * 1024 if args.max_memory else None
+    
+    if args.profile is not None:
+        profiler.enable()
+    shared_cache.set_budget(args.cache_mb * 1024 * 1024)
     
     try:
         # Load the configuration file
         with open(args.config_file, 'r') as f:
             config = json.load(f)
         
-        # Create the wall visualizations and get the list of generated images
-        generated_images = create_wall_visualization(config)
+        image_count = None
+        if args.vector:
+            # Lay out the pages and let the PDF place each tile; no wall JPEGs are rendered
+            generated_images = plan_wall_layouts(config['pages'])
+        elif args.stream:
+            # Pages are rendered lazily while the PDF is written
+            generated_images = iter_wall_pages(config, jobs=args.jobs, force=args.force, save_images=not args.no_jpeg,
+                                               encoder=encoder, max_memory=max_memory)
+            image_count = sum(1 for page in config['pages'] if page.get('images'))
+        else:
+            # Create the wall visualizations and get the list of generated images
+            generated_images = create_wall_visualization(config, jobs=args.jobs, force=args.force, encoder=encoder,
+                                                         max_memory=max_memory)
         
         # If the pdf flag is set, generate a PDF with all the images
-        if (args.pdf or args.print is not None) and generated_images:
+        if (args.pdf or args.vector or args.stream or args.print is not None) and generated_images:
             # Create PDF filename based on the input JSON filename
-            config_path = pathlib.Path(args.config_file)
-            base_name = config_path.stem.replace('visualize-wall-', '')
-            pdf_path = f"./out/visualize-wall-{base_name}.pdf"
-            
-            # If print-ready option is set, modify the filename
-            if args.print is not None:
-                # Include page count in filename if specified
-                if args.print:
-                    pdf_path = f"./out/visualize-wall-{base_name}-print-{args.print}.pdf"
-                else:
-                    pdf_path = f"./out/visualize-wall-{base_name}-print.pdf"
+            pdf_path = wall_pdf_path(args.config_file, args.print is not None, args.print)
             
             # Pass the cover image path to the PDF generator
-            pdf_header = config.get('title', 'Deltaware.in - Tiles Catalog - Whatsapp: 9940198130')
+            pdf_header = config.get('title', DEFAULT_PDF_TITLE)
             cover_image_path = args.cover
             
             # Generate PDF with the optional page count
             generate_pdf(generated_images, pdf_path, title=pdf_header, 
                         cover_image_path=cover_image_path, print_ready=(args.print is not None), 
-                        page_count=args.print)
+                        page_count=args.print, dpi=args.dpi, image_count=image_count)
             
             if args.print is not None:
                 print_message = f"Generated print-ready PDF with embedded fonts: {pdf_path}"
@@ -401,6 +955,8 @@ def main():
         print(f"Error: Invalid JSON in configuration file '{args.config_file}'")
     except Exception as e:
         print(f"Error: {e}")
+    
+    profiler.report(args.profile, 'visualize_wall')
 
 if __name__ == "__main__":
     main()